@@ -0,0 +1,86 @@
+"""
+Compare the WSGI (gunicorn) and ASGI (uvicorn) entry points on the hot read
+routes at high concurrency.
+
+    python benchmarks/asgi_vs_wsgi.py --rows 5000 --concurrency 200 --duration 15
+
+Prints a JSON report with requests/sec and latency percentiles per server.
+Before loading them, each path (and a CORS preflight) is fetched once from
+both servers with an Origin header, `parity_differences` lists the paths
+whose status, body or Access-Control-Allow-Origin differ.
+Point --database-url at Postgres for meaningful numbers, the SQLite default
+serializes every connection on one file.
+"""
+import json
+import argparse
+import urllib.error
+import urllib.request
+from common import DEFAULT_DATABASE_URL, seed, free_port, server, gunicorn_command, uvicorn_command
+from loadgen import load
+
+PATHS = [
+    "/people?limit=50",
+    "/planet?limit=50&sort=-population",
+    "/people?eye_color=blue&limit=20",
+    "/favorites?type=people&limit=50",
+    "/people/1",
+    "/planet/2",
+]
+ORIGIN = "https://client.example"
+
+
+def fetch(url, method="GET", headers=None):
+    request = urllib.request.Request(url, method=method, headers={"Origin": ORIGIN, **(headers or {})})
+    try:
+        response = urllib.request.urlopen(request, timeout=10)
+    except urllib.error.HTTPError as error:
+        response = error
+    with response:
+        body = response.read()
+        return {
+            "status": response.status,
+            "allow_origin": response.headers.get("Access-Control-Allow-Origin"),
+            "body": json.loads(body) if body else None,
+        }
+
+
+def parity_sample(base_url):
+    """What each path answers to a browser, compared between the two servers."""
+    sample = {path: fetch(base_url + path) for path in PATHS + ["/people/999999"]}
+    sample["OPTIONS /people"] = fetch(base_url + "/people", "OPTIONS", {"Access-Control-Request-Method": "GET"})
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    seed(args.database_url, args.rows)
+    # the in-process response cache would hide the database from the WSGI numbers
+    env = {"DATABASE_URL": args.database_url, "RESPONSE_CACHE_ENABLED": "0"}
+    servers = {
+        "wsgi": lambda port: gunicorn_command(port, args.workers, args.threads, "gthread"),
+        "asgi": lambda port: uvicorn_command(port, args.workers),
+    }
+
+    report = {"rows": args.rows, "concurrency": args.concurrency, "duration": args.duration, "results": {}}
+    samples = {}
+    for name, command in servers.items():
+        port = free_port()
+        with server(command(port), port, env):
+            base_url = f"http://127.0.0.1:{port}"
+            samples[name] = parity_sample(base_url)
+            load(base_url, PATHS, concurrency=10, duration=1.0)  # warm the pools
+            report["results"][name] = load(base_url, PATHS, args.concurrency, args.duration)
+    report["parity_differences"] = [path for path in samples["wsgi"] if samples["wsgi"][path] != samples["asgi"][path]]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Shared helpers for the benchmark scripts: seeding a database with the app's
+models and starting/stopping a server process on a free port.
+"""
+import os
+import sys
+import time
+import socket
+import subprocess
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+DEFAULT_DATABASE_URL = "sqlite:////tmp/starwars-bench.db"
+
+
+def import_app(db_url):
+    """Import the Flask app bound to `db_url` (the app reads DATABASE_URL at import)."""
+    os.environ["DATABASE_URL"] = db_url
+    if SRC not in sys.path:
+        sys.path.insert(0, SRC)
+    from app import app
+    return app
+
+
+def seed(db_url, rows=1000, users=None, favorites_per_user=5):
+    """
+    Recreate the tables at `db_url` with `rows` people and planets.
+
+    People live on, and favorites point at, the first half of the rows only,
+    so benchmarks can delete from the second half without breaking references.
+    """
+    app = import_app(db_url)
+    from sqlalchemy import insert
+    from models import db, User, People, Planet, Favorite
+    from favorite_counts import reconcile
+
+    if db_url.startswith("sqlite:///"):
+        # pooled connections would keep writing to the unlinked file
+        with app.app_context():
+            db.engine.dispose()
+        path = db_url[len("sqlite:///"):]
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    users = users or max(1, rows // 10)
+    referenced = max(1, rows // 2)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(Planet), [
+            {"name": f"Planet {i}", "climate": ("arid", "temperate", "frozen")[i % 3], "population": i * 1000}
+            for i in range(rows)
+        ])
+        db.session.execute(insert(People), [
+            {"name": f"Person {i}", "age": str(18 + i % 80), "eye_color": ("blue", "brown", "red")[i % 3],
+             "home_planet_id": 1 + i % referenced}
+            for i in range(rows)
+        ])
+        db.session.execute(insert(User), [
+            {"email": f"user{i}@example.com", "password": "secret", "is_active": True}
+            for i in range(users)
+        ])
+        db.session.execute(insert(Favorite), [
+            {"user_id": 1 + u, "type": ("people", "planet")[f % 2], "item_id": 1 + (u * favorites_per_user + f) % referenced}
+            for u in range(users) for f in range(favorites_per_user)
+        ])
+        db.session.commit()
+        reconcile()
+        db.engine.dispose()
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not listen on port {port} within {timeout}s")
+
+
+@contextmanager
+def server(command, port, env=None):
+    """Run `command` (which must listen on `port`) for the duration of the block."""
+    process = subprocess.Popen(command, cwd=ROOT, env={**os.environ, **(env or {})},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def gunicorn_command(port, workers=2, threads=1, worker_class="sync"):
+    return [sys.executable, "-m", "gunicorn", "wsgi", "--chdir", SRC, "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers), "--threads", str(threads), "--worker-class", worker_class,
+            "--log-level", "warning"]
+
+
+def uvicorn_command(port, workers=2):
+    return [sys.executable, "-m", "uvicorn", "asgi:application", "--app-dir", SRC, "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning", "--no-access-log"]
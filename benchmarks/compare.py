@@ -0,0 +1,61 @@
+"""
+Diff two benchmark reports written by suite.py.
+
+    python benchmarks/compare.py before.json after.json [--threshold 10]
+
+Prints rps, p50/p99 latency and queries per request per route and phase, and
+exits with status 1 when a route got slower than --threshold percent.
+"""
+import sys
+import json
+import argparse
+
+METRICS = ("rps", "p50_ms", "p99_ms", "queries_per_request", "peak_rss_mb")
+# for these a lower number is better
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "queries_per_request", "peak_rss_mb")
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) * 100 / before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="p50 regression percent that fails")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    print(f"{before.get('revision')} -> {after.get('revision')}")
+    regressions = []
+    for phase, routes in after["results"].items():
+        print(f"\n{phase}")
+        print(f"{'route':32}" + "".join(f"{metric:>26}" for metric in METRICS))
+        for name, stats in routes.items():
+            old = before["results"].get(phase, {}).get(name, {})
+            cells = []
+            for metric in METRICS:
+                delta = change(old.get(metric), stats.get(metric))
+                cell = f"{old.get(metric)} -> {stats.get(metric)}"
+                if delta is not None:
+                    cell += f" ({delta:+.0f}%)"
+                    worse = delta if metric in LOWER_IS_BETTER else -delta
+                    if metric == "p50_ms" and worse > args.threshold:
+                        regressions.append(f"{phase} {name}")
+                cells.append(f"{cell:>26}")
+            print(f"{name:32}" + "".join(cells))
+
+    if regressions:
+        print(f"\n{len(regressions)} route(s) slower than {args.threshold}%: {', '.join(regressions)}", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+CPU versus bytes for every compression level on real API payloads.
+
+    python benchmarks/compression.py --rows 5000 --output compression.json
+
+Seeds the database, fetches uncompressed bodies through the Flask test
+client (a /people and a /favorites page, the /people NDJSON export and the
+/people page as MessagePack), then compresses each with gzip levels 1-9 and,
+when brotli is installed, brotli qualities 0-11, reporting the compressed
+size, ratio and compression/decompression time. Use the numbers to pick
+COMPRESSION_GZIP_LEVEL and COMPRESSION_BROTLI_QUALITY.
+"""
+import sys
+import json
+import time
+import zlib
+import argparse
+from common import DEFAULT_DATABASE_URL, seed
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def payloads(app, limit):
+    client = app.test_client()
+    identity = {"Accept-Encoding": "identity"}
+    return {
+        "people page (json)": client.get(f"/people?limit={limit}", headers=identity).get_data(),
+        "favorites page (json)": client.get(f"/favorites?limit={limit}", headers=identity).get_data(),
+        "people export (ndjson)": client.get("/people?stream=1", headers=identity).get_data(),
+        "people page (msgpack)": client.get(f"/people?limit={limit}",
+                                            headers=dict(identity, Accept="application/msgpack")).get_data(),
+    }
+
+
+def measure(data, compress, decompress, repeat):
+    compressed, compress_time = timed(lambda: compress(data), repeat)
+    _, decompress_time = timed(lambda: decompress(compressed), repeat)
+    return {
+        "bytes": len(compressed),
+        "ratio": round(len(data) / len(compressed), 2),
+        "compress_ms": round(compress_time * 1000, 3),
+        "compress_mb_s": round(len(data) / compress_time / 2 ** 20, 1),
+        "decompress_ms": round(decompress_time * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=1000, help="page size of the fetched pages")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    app = seed(args.database_url, args.rows, favorites_per_user=20)
+    from compression import compress, brotli
+
+    report = {"rows": args.rows, "payloads": {}}
+    for name, data in payloads(app, args.limit).items():
+        levels = {}
+        for level in range(1, 10):
+            levels[f"gzip-{level}"] = measure(data, lambda body: compress(body, "gzip", level),
+                                              lambda body: zlib.decompress(body, 47), args.repeat)
+        if brotli is not None:
+            for quality in range(12):
+                levels[f"br-{quality}"] = measure(data, lambda body: compress(body, "br", quality),
+                                                  brotli.decompress, args.repeat)
+        report["payloads"][name] = {"bytes": len(data), "levels": levels}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
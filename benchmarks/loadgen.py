@@ -0,0 +1,114 @@
+"""
+A small asyncio HTTP/1.1 load generator.
+
+Every worker holds one keep-alive connection and sends requests back to back,
+so `concurrency` is the number of requests in flight. Used by the benchmark
+scripts in this folder, it has no dependency outside the standard library.
+
+Requests are either paths to GET, cycled round-robin, or an iterator of
+`(method, path, json_body)` tuples; the run ends early when it is exhausted.
+"""
+import json
+import time
+import asyncio
+import itertools
+from urllib.parse import urlsplit
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+async def read_response(reader):
+    """Read one response, returning `(status, headers, body)`."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by server")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding") == "chunked":
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            body += chunk[:-2]
+        return status, headers, bytes(body)
+    return status, headers, await reader.readexactly(int(headers.get("content-length", 0)))
+
+
+def encode_request(host, request, headers):
+    method, path, body = ("GET", request, None) if isinstance(request, str) else request
+    payload = b"" if body is None else json.dumps(body).encode()
+    if body is not None:
+        headers += f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+    return f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n{headers}\r\n".encode("latin-1") + payload
+
+
+async def _worker(host, port, requests, deadline, latencies, counters, headers):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        request = next(requests, None)
+        if request is None:
+            break
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(encode_request(host, request, headers))
+            status, response_headers, _ = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                counters["errors"] += 1
+            if response_headers.get("connection") == "close":
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            counters["errors"] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(base_url, requests, concurrency=50, duration=10.0, headers=None):
+    """Send `requests` for `duration` seconds, return a summary dict."""
+    url = urlsplit(base_url)
+    if isinstance(requests, (list, tuple)):
+        requests = itertools.cycle(requests)
+    extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+    latencies, counters = [], {"errors": 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _worker(url.hostname, url.port or 80, requests, start + duration, latencies, counters, extra)
+        for _ in range(concurrency)
+    ))
+    return summarize(latencies, counters["errors"], time.perf_counter() - start)
+
+
+def load(base_url, requests, concurrency=50, duration=10.0, headers=None):
+    return asyncio.run(run(base_url, requests, concurrency, duration, headers))
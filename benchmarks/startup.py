@@ -0,0 +1,158 @@
+"""
+Cold start cost: import time of the app and gunicorn time to first request.
+
+    python benchmarks/startup.py --runs 5 --output startup-$(git rev-parse --short HEAD).json
+
+For each variant (the defaults, and ENABLE_ADMIN=0 ENABLE_SWAGGER=0) it:
+
+- imports src/app.py in a fresh interpreter under `python -X importtime`,
+  reporting the total and the modules app.py imports directly, heaviest first
+  (cumulative, so a shared dependency is charged to whichever imports it first)
+- times the first GET /admin/ and GET /swagger.json of a fresh process, the
+  work moved off the import path
+- starts gunicorn and measures from spawning it to the first 200 on GET /,
+  which is what an autoscaled or woken up free tier instance makes clients wait
+
+Medians over --runs are reported. Run it on two revisions to compare.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from common import DEFAULT_DATABASE_URL, ROOT, SRC, free_port, gunicorn_command
+
+VARIANTS = {
+    "default": {},
+    "admin and swagger disabled": {"ENABLE_ADMIN": "0", "ENABLE_SWAGGER": "0"},
+}
+
+FIRST_REQUESTS = """
+import sys, time
+from app import app
+client = app.test_client()
+timings = {}
+for path in ("/admin/", "/swagger.json"):
+    start = time.perf_counter()
+    status = client.get(path).status_code
+    timings[path] = {"status": status, "ms": round((time.perf_counter() - start) * 1000, 2)}
+print(__import__("json").dumps(timings))
+"""
+
+
+def python(args, env):
+    return subprocess.run([sys.executable, *args], cwd=SRC, env={**os.environ, **env},
+                          capture_output=True, text=True, check=True)
+
+
+def parse_importtime(stderr):
+    """`(total_us, {direct import of app: cumulative_us})` from `-X importtime` output."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((depth, name.strip(), int(cumulative)))
+
+    # children are printed before their parent, so app's direct imports are the depth 1 lines before it
+    total, direct = None, {}
+    for index, (depth, name, cumulative) in enumerate(modules):
+        if name == "app" and depth == 0:
+            total = cumulative
+            for child_depth, child, child_cumulative in reversed(modules[:index]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    direct[child] = child_cumulative
+            break
+    return total, direct
+
+
+def import_time(env, runs, top):
+    totals, by_module = [], {}
+    for _ in range(runs):
+        total, direct = parse_importtime(python(["-X", "importtime", "-c", "import app"], env).stderr)
+        totals.append(total)
+        for name, cumulative in direct.items():
+            by_module.setdefault(name, []).append(cumulative)
+    heaviest = sorted(by_module.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:top]
+    return {
+        "total_ms": round(statistics.median(totals) / 1000, 1),
+        "modules_ms": {name: round(statistics.median(values) / 1000, 1) for name, values in heaviest},
+    }
+
+
+def first_requests(env, runs):
+    samples = [json.loads(python(["-c", FIRST_REQUESTS], env).stdout) for _ in range(runs)]
+    return {
+        path: {"status": samples[0][path]["status"], "ms": statistics.median(sample[path]["ms"] for sample in samples)}
+        for path in samples[0]
+    }
+
+
+def time_to_first_request(env, workers, timeout=60.0):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/"
+    start = time.perf_counter()
+    process = subprocess.Popen(gunicorn_command(port, workers), cwd=ROOT, env={**os.environ, **env},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f"gunicorn did not answer {url} within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--top", type=int, default=15, help="direct imports of app.py to list")
+    parser.add_argument("--skip-server", action="store_true", help="only measure the imports")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {"revision": revision(), "python": sys.version.split()[0], "runs": args.runs,
+              "workers": args.workers, "variants": {}}
+    for name, variant in VARIANTS.items():
+        env = dict(variant, DATABASE_URL=args.database_url)
+        result = {"env": variant, "import": import_time(env, args.runs, args.top),
+                  "first_requests": first_requests(env, args.runs)}
+        if not args.skip_server:
+            samples = [time_to_first_request(env, args.workers) for _ in range(args.runs)]
+            result["gunicorn_first_request_ms"] = round(statistics.median(samples) * 1000, 1)
+        report["variants"][name] = result
+        print(f"{name}: import {result['import']['total_ms']} ms"
+              + (f", gunicorn first request {result['gunicorn_first_request_ms']} ms" if not args.skip_server else ""),
+              file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Load test and micro-benchmark for every route of src/app.py.
+
+    python benchmarks/suite.py --rows 5000 --output bench-$(git rev-parse --short HEAD).json
+    python benchmarks/compare.py bench-old.json bench-new.json
+
+Seeds N people and planets (plus N/10 users with 5 favorites each) into
+--database-url, SQLite by default or a local Postgres, then runs every route:
+
+- in process through the Flask test client, one request at a time, recording
+  latency percentiles, throughput, SQL queries per request and peak RSS
+- against a real gunicorn process with the asyncio load generator, recording
+  throughput, latency percentiles and the peak RSS of master plus workers
+
+Each GET replays the same URLs, so with the caches on every request after
+the first is a cache hit. The `test_client` and `gunicorn` phases therefore
+run with the response cache disabled and a 0 byte object cache, measuring
+the queries and serialization. The `*_warm_cache` phases replay only the
+GET routes with the caches on, and run first because the cold phases include
+the destructive routes.
+
+The database is reseeded before the gunicorn phases. Write routes create new
+rows or consume ids from a pool of seeded rows nothing else references, so a
+route that runs out of ids ends early rather than measuring 404s.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import itertools
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from common import DEFAULT_DATABASE_URL, ROOT, seed, free_port, server, gunicorn_command
+from loadgen import load, summarize
+
+
+class Context:
+    def __init__(self, rows, users, favorites_per_user):
+        self.rows = rows
+        self.users = users
+        self.favorites_per_user = favorites_per_user
+        self.favorites = users * favorites_per_user
+        self.referenced = max(1, rows // 2)
+
+    def owner(self, favorite_id):
+        return 1 + (favorite_id - 1) // self.favorites_per_user
+
+
+def cycle_ids(start, stop):
+    return itertools.cycle(range(start, max(start + 1, stop)))
+
+
+def chunks(ids, size=10):
+    ids = iter(ids)
+    while chunk := list(itertools.islice(ids, size)):
+        yield chunk
+
+
+def person(i, ctx):
+    return {"name": f"Bench person {i}", "age": "30", "eye_color": "green", "home_planet_id": 1 + i % ctx.referenced}
+
+
+def planet(i):
+    return {"name": f"Bench planet {i}", "climate": "temperate", "population": i}
+
+
+def get(*paths):
+    return lambda ctx: (("GET", path, None) for path in itertools.cycle(paths))
+
+
+def get_ids(template, count):
+    return lambda ctx: (("GET", template.format(id), None) for id in cycle_ids(1, count(ctx) + 1))
+
+
+# name -> ctx -> iterator of (method, path, json body); destructive routes last
+ROUTES = {
+    "GET /": get("/"),
+    "GET /swagger.json": get("/swagger.json"),
+    "GET /people": get("/people?limit=50"),
+    "GET /people?sort": get("/people?limit=50&sort=-name"),
+    "GET /people?filter": get("/people?eye_color=blue&limit=50"),
+    "GET /people?fields": get("/people?limit=50&fields=id,name"),
+    "GET /people?include": get("/people?limit=50&include=home_planet"),
+    "GET /people?q": get("/people?q=Person%201&limit=50"),
+    "GET /people?since": get("/people?since=2000-01-01T00:00:00Z&limit=50"),
+    "GET /people?stream": get("/people?stream=1"),
+    "GET /people/<id>": get_ids("/people/{}", lambda ctx: ctx.referenced),
+    "GET /planet": get("/planet?limit=50"),
+    "GET /planet?include": get("/planet?limit=50&include=residents"),
+    "GET /planet/<id>": get_ids("/planet/{}", lambda ctx: ctx.referenced),
+    "GET /users": get("/users?limit=50"),
+    "GET /users/<id>/favorites": get_ids("/users/{}/favorites", lambda ctx: ctx.users),
+    "GET /favorites": get("/favorites?limit=50"),
+    "GET /favorites/top": get("/favorites/top?type=people&limit=10", "/favorites/top?type=planet&limit=10"),
+    "GET /cache/stats": get("/cache/stats"),
+    "GET /db/pool": get("/db/pool"),
+    "GET /metrics": get("/metrics"),
+    "POST /people": lambda ctx: (("POST", "/people", person(i, ctx)) for i in itertools.count()),
+    "POST /people (bulk 100)": lambda ctx: (
+        ("POST", "/people", [person(i * 100 + j, ctx) for j in range(100)]) for i in itertools.count()),
+    "PUT /people/<id>": lambda ctx: (
+        ("PUT", f"/people/{id}", person(id, ctx)) for id in cycle_ids(1, ctx.referenced + 1)),
+    "PATCH /people/<id>": lambda ctx: (
+        ("PATCH", f"/people/{id}", {"eye_color": "green"}) for id in cycle_ids(1, ctx.referenced + 1)),
+    "PATCH /people": lambda ctx: (
+        ("PATCH", "/people", {"ids": ids, "set": {"eye_color": "brown"}})
+        for ids in chunks(cycle_ids(1, ctx.referenced + 1))),
+    "POST /planet": lambda ctx: (("POST", "/planet", planet(i)) for i in itertools.count()),
+    "PUT /planet/<id>": lambda ctx: (
+        ("PUT", f"/planet/{id}", planet(id)) for id in cycle_ids(1, ctx.referenced + 1)),
+    "PATCH /planet/<id>": lambda ctx: (
+        ("PATCH", f"/planet/{id}", {"climate": "arid"}) for id in cycle_ids(1, ctx.referenced + 1)),
+    "PATCH /planet": lambda ctx: (
+        ("PATCH", "/planet", {"ids": ids, "set": {"climate": "frozen"}})
+        for ids in chunks(cycle_ids(1, ctx.referenced + 1))),
+    "POST /users": lambda ctx: (
+        ("POST", "/users", {"email": f"bench{i}@example.com", "is_active": True}) for i in itertools.count()),
+    "POST /favorite": lambda ctx: (
+        ("POST", "/favorite", {"type": "people", "user_id": 1 + i % ctx.users, "item_id": ctx.rows + i})
+        for i in itertools.count()),
+    "PATCH /favorite/<id>": lambda ctx: (
+        ("PATCH", f"/favorite/{id}", {"user_id": ctx.owner(id)}) for id in cycle_ids(1, ctx.favorites + 1)),
+    "PATCH /favorites": lambda ctx: (
+        ("PATCH", "/favorites", {"ids": ids, "set": {"user_id": ctx.owner(ids[0])}})
+        for ids in chunks(cycle_ids(1, ctx.favorites_per_user + 1), ctx.favorites_per_user)),
+    "DELETE /people/<id>": lambda ctx: (
+        ("DELETE", f"/people/{id}", None) for id in range(ctx.referenced + 1, ctx.referenced + ctx.rows // 4 + 1)),
+    "DELETE /people": lambda ctx: (
+        ("DELETE", f"/people?ids={','.join(map(str, ids))}", None)
+        for ids in chunks(range(ctx.referenced + ctx.rows // 4 + 1, ctx.rows + 1))),
+    "DELETE /planet/<id>": lambda ctx: (
+        ("DELETE", f"/planet/{id}", None) for id in range(ctx.referenced + 1, ctx.referenced + ctx.rows // 4 + 1)),
+    "DELETE /planet": lambda ctx: (
+        ("DELETE", f"/planet?ids={','.join(map(str, ids))}", None)
+        for ids in chunks(range(ctx.referenced + ctx.rows // 4 + 1, ctx.rows + 1))),
+    "DELETE /favorite/<id>": lambda ctx: (
+        ("DELETE", f"/favorite/{id}", None) for id in range(ctx.favorites // 2 + 1, ctx.favorites * 3 // 4 + 1)),
+    "DELETE /favorites": lambda ctx: (
+        ("DELETE", f"/favorites?ids={','.join(map(str, ids))}", None)
+        for ids in chunks(range(ctx.favorites * 3 // 4 + 1, ctx.favorites + 1))),
+}
+
+GET_ROUTES = {name: factory for name, factory in ROUTES.items() if name.startswith("GET ")}
+# what caches_disabled() does to the in process caches, for the gunicorn workers
+NO_CACHE_ENV = {"RESPONSE_CACHE_ENABLED": "0", "OBJECT_CACHE_BYTES": "0"}
+
+SKIPPED_RULES = ("/static/", "/admin")
+
+
+def uncovered_rules(app):
+    """`METHOD /rule` pairs of the app that no ROUTES entry exercises."""
+    covered = {" ".join(name.split()[:2]).split("?")[0] for name in ROUTES}
+    uncovered = []
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith(SKIPPED_RULES):
+            continue
+        path = rule.rule.replace("<int:people_id>", "<id>").replace("<int:planet_id>", "<id>") \
+            .replace("<int:user_id>", "<id>").replace("<int:favorite_id>", "<id>")
+        uncovered += [f"{method} {path}" for method in sorted(rule.methods - {"HEAD", "OPTIONS"})
+                      if f"{method} {path}" not in covered]
+    return uncovered
+
+
+def peak_rss_mb():
+    import resource
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20, 1)
+
+
+@contextmanager
+def caches_disabled():
+    from cache import response_cache, object_cache
+    enabled, max_bytes = response_cache.enabled, object_cache.max_bytes
+    # a 0 byte object cache evicts every entry it stores
+    response_cache.enabled, object_cache.max_bytes = False, 0
+    try:
+        yield
+    finally:
+        response_cache.enabled, object_cache.max_bytes = enabled, max_bytes
+
+
+def run_test_client(app, ctx, requests_per_route, routes=ROUTES):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    queries = {"count": 0}
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_query(*args):
+        queries["count"] += 1
+
+    client = app.test_client()
+    results = {}
+    for name, factory in routes.items():
+        latencies, errors = [], 0
+        first_query = queries["count"]
+        start = time.perf_counter()
+        for method, path, body in itertools.islice(factory(ctx), requests_per_route):
+            sent = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            latencies.append(time.perf_counter() - sent)
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - start
+        executed = queries["count"] - first_query
+        results[name] = dict(summarize(latencies, errors, elapsed),
+                             queries_per_request=round(executed / len(latencies), 2) if latencies else None,
+                             peak_rss_mb=peak_rss_mb())
+    return results
+
+
+def process_tree_rss(pid):
+    """Resident set size in bytes of `pid` and its children, 0 without /proc."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            total += next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmRSS:"))
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            total += sum(process_tree_rss(int(child)) for child in children.read().split())
+    except (OSError, StopIteration):
+        pass
+    return total
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid, self.interval = pid, interval
+        self.peak = 0
+        self.done = threading.Event()
+
+    def run(self):
+        while True:
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            if self.done.wait(self.interval):
+                return
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        return round(self.peak / 2 ** 20, 1) if self.peak else None
+
+
+def run_gunicorn(ctx, args, routes=ROUTES, cache_env=NO_CACHE_ENV):
+    port = free_port()
+    env = dict(cache_env, DATABASE_URL=args.database_url)
+    results = {}
+    with server(gunicorn_command(port, args.workers, args.threads, "gthread"), port, env) as process:
+        base_url = f"http://127.0.0.1:{port}"
+        # the first requests of each worker pay for lazy imports and connecting
+        load(base_url, ["/", "/people?limit=1"], args.concurrency, 1.0)
+        for name, factory in routes.items():
+            sampler = RSSSampler(process.pid)
+            sampler.start()
+            stats = load(base_url, factory(ctx), args.concurrency, args.duration)
+            results[name] = dict(stats, queries_per_request=None, peak_rss_mb=sampler.stop())
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=1000, help="people and planets to seed")
+    parser.add_argument("--requests", type=int, default=200, help="test client requests per route")
+    parser.add_argument("--duration", type=float, default=3.0, help="gunicorn seconds per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--skip-server", action="store_true", help="only run the test client phase")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    ctx = Context(args.rows, max(1, args.rows // 10), 5)
+    app = seed(args.database_url, args.rows, ctx.users, ctx.favorites_per_user)
+    report = {
+        "revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": args.database_url.split(":", 1)[0],
+        "settings": {key: value for key, value in vars(args).items() if key not in ("database_url", "output")},
+        "uncovered_routes": uncovered_rules(app),
+        "results": {},
+    }
+    results = report["results"]
+    results["test_client_warm_cache"] = run_test_client(app, ctx, args.requests, GET_ROUTES)
+    with caches_disabled():
+        results["test_client"] = run_test_client(app, ctx, args.requests)
+    if not args.skip_server:
+        seed(args.database_url, args.rows, ctx.users, ctx.favorites_per_user)
+        results["gunicorn_warm_cache"] = run_gunicorn(ctx, args, GET_ROUTES, cache_env={})
+        results["gunicorn"] = run_gunicorn(ctx, args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# Picked up by `gunicorn wsgi --chdir ./src/` (see Procfile) from the repo root.
+import os
+import shutil
+
+# every worker writes its Prometheus samples here so /metrics can aggregate them (see src/metrics.py)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/starwars-metrics")
+
+
+def on_starting(server):
+    # samples left over from a previous run would be summed into the new one
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # commit queued favorite changes before the worker goes away (see src/write_behind.py)
+    from write_behind import favorite_writes
+    if favorite_writes.enabled:
+        favorite_writes.drain()
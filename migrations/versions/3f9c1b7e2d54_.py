@@ -0,0 +1,56 @@
+"""add indexes for the favorite and people access paths
+
+Revision ID: 3f9c1b7e2d54
+Revises: b16bf56c2781
+Create Date: 2025-03-08 10:12:41.530217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c1b7e2d54'
+down_revision = 'b16bf56c2781'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the oldest row of every duplicated favorite so the unique constraint can be created
+    op.execute(
+        "DELETE FROM favorite WHERE id NOT IN "
+        "(SELECT MIN(id) FROM favorite GROUP BY user_id, type, item_id)"
+    )
+
+    with op.batch_alter_table('favorite', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_favorite_user_id_type_item_id', ['user_id', 'type', 'item_id'])
+        batch_op.create_index('ix_favorite_type_item_id', ['type', 'item_id'], unique=False)
+        batch_op.create_index('ix_favorite_updated_at_id', ['updated_at', 'id'], unique=False)
+
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_people_home_planet_id'), ['home_planet_id'], unique=False)
+        batch_op.create_index('ix_people_updated_at_id', ['updated_at', 'id'], unique=False)
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.create_index('ix_planet_updated_at_id', ['updated_at', 'id'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_updated_at_id', ['updated_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_updated_at_id')
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.drop_index('ix_planet_updated_at_id')
+
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.drop_index('ix_people_updated_at_id')
+        batch_op.drop_index(batch_op.f('ix_people_home_planet_id'))
+
+    with op.batch_alter_table('favorite', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_updated_at_id')
+        batch_op.drop_index('ix_favorite_type_item_id')
+        batch_op.drop_constraint('uq_favorite_user_id_type_item_id', type_='unique')
@@ -0,0 +1,48 @@
+"""add sort and name search indexes for people and planet
+
+Revision ID: 5b8f0e3a7c21
+Revises: 9a4e6d2c8b17
+Create Date: 2025-03-12 11:27:54.804113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8f0e3a7c21'
+down_revision = '9a4e6d2c8b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.create_index('ix_people_name_id', ['name', 'id'], unique=False)
+        batch_op.create_index('ix_people_eye_color_id', ['eye_color', 'id'], unique=False)
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.create_index('ix_planet_name_id', ['name', 'id'], unique=False)
+        batch_op.create_index('ix_planet_population_id', ['population', 'id'], unique=False)
+
+    # ?q= substring search, SQLite uses an in-process prefix index instead (see src/search.py)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_people_name_trgm', 'people', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+        op.create_index('ix_planet_name_trgm', 'planet', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_planet_name_trgm', table_name='planet')
+        op.drop_index('ix_people_name_trgm', table_name='people')
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.drop_index('ix_planet_population_id')
+        batch_op.drop_index('ix_planet_name_id')
+
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.drop_index('ix_people_eye_color_id')
+        batch_op.drop_index('ix_people_name_id')
@@ -0,0 +1,32 @@
+"""add ingest_checkpoint table for resumable bulk ingestion
+
+Revision ID: 7d2a9f4c1e63
+Revises: 5b8f0e3a7c21
+Create Date: 2025-03-14 10:05:41.562370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2a9f4c1e63'
+down_revision = '5b8f0e3a7c21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ingest_checkpoint',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('source', sa.String(), nullable=False),
+    sa.Column('fingerprint', sa.String(), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('ingest_checkpoint')
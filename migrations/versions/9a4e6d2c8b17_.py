@@ -0,0 +1,35 @@
+"""add tombstone table for delta sync
+
+Revision ID: 9a4e6d2c8b17
+Revises: 3f9c1b7e2d54
+Create Date: 2025-03-09 16:40:03.118592
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e6d2c8b17'
+down_revision = '3f9c1b7e2d54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('resource', sa.String(), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.create_index('ix_tombstone_resource_deleted_at', ['resource', 'deleted_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.drop_index('ix_tombstone_resource_deleted_at')
+
+    op.drop_table('tombstone')
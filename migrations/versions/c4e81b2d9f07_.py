@@ -0,0 +1,43 @@
+"""add favorite_count table with denormalized favorite counts
+
+Revision ID: c4e81b2d9f07
+Revises: 7d2a9f4c1e63
+Create Date: 2025-03-18 16:22:09.104853
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e81b2d9f07'
+down_revision = '7d2a9f4c1e63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('favorite_count',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('type', sa.String(), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('type', 'item_id', name='uq_favorite_count_type_item_id')
+    )
+    with op.batch_alter_table('favorite_count', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_count_type_count_item_id', ['type', 'count', 'item_id'], unique=False)
+
+    # start from the favorites already stored
+    op.execute(
+        "INSERT INTO favorite_count (type, item_id, count, updated_at) "
+        "SELECT type, item_id, count(*), CURRENT_TIMESTAMP FROM favorite GROUP BY type, item_id"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('favorite_count', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_count_type_count_item_id')
+
+    op.drop_table('favorite_count')
@@ -0,0 +1,30 @@
+"""add table_version table with per table write counters for ETags
+
+Revision ID: e2b7d4a81c39
+Revises: c4e81b2d9f07
+Create Date: 2025-03-21 11:47:30.218640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7d4a81c39'
+down_revision = 'c4e81b2d9f07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('table_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('resource', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('resource')
+    )
+
+
+def downgrade():
+    op.drop_table('table_version')
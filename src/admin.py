@@ -1,16 +1,93 @@
+"""
+The Flask-Admin UI, served under /admin by a separate Flask app.
+
+Flask-Admin and the model form machinery it pulls in take a good share of
+the app's import time, and a blueprint cannot be added to the API app once it
+has served a request. So setup_admin() only wraps the API app's WSGI callable:
+the admin app is imported and built by the first request under /admin, every
+other request goes straight to the API. ENABLE_ADMIN=0 leaves /admin out
+altogether.
+
+The admin views use a session of their own on the API app's engine, so
+their queries share the pool and the per connection setup of
+database.configure_engine(), and writes bump the table versions like the
+API's. The admin app gets the API's profiling, metrics and compression
+hooks.
+"""
 import os
-from flask_admin import Admin
+import threading
+from flask import Flask
+from sqlalchemy.orm import scoped_session, sessionmaker
 from models import db, User
-from flask_admin.contrib.sqla import ModelView
+import versions
+import profiling
+import metrics
+import compression
 
-def setup_admin(app):
-    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
-    app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+ENABLE_ADMIN = os.getenv("ENABLE_ADMIN", "1") == "1"
+ADMIN_URL = "/admin"
+
+
+def admin_session(app, admin_app):
+    """A session on the engine of `app`, instead of db.init_app(admin_app) opening a second pool."""
+    with app.app_context():
+        engine = db.engine
+    session = scoped_session(sessionmaker(bind=engine))
+    versions.watch(session)
+
+    @admin_app.teardown_appcontext
+    def remove_session(exception=None):
+        session.remove()
+
+    return session
+
+
+def create_admin_app(app):
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
+    admin_app = Flask(__name__)
+    admin_app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
+    admin_app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
+    session = admin_session(app, admin_app)
+    profiling.init_app(admin_app)
+    metrics.init_app(admin_app)
+    compression.init_app(admin_app)
+    admin = Admin(admin_app, name='4Geeks Admin', url=ADMIN_URL, template_mode='bootstrap3')
 
-    
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    admin.add_view(ModelView(User, session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, session))
+    return admin_app
+
+
+class AdminDispatcher:
+    """WSGI middleware sending /admin to the admin app, built on its first request, and the rest to the API."""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.admin_app = None
+        self._lock = threading.Lock()
+
+    def get_admin_app(self):
+        if self.admin_app is None:
+            with self._lock:
+                if self.admin_app is None:
+                    self.admin_app = create_admin_app(self.app)
+        return self.admin_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path == ADMIN_URL or path.startswith(ADMIN_URL + "/"):
+            return self.get_admin_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+def setup_admin(app):
+    if not ENABLE_ADMIN:
+        return
+    app.wsgi_app = AdminDispatcher(app)
+    app.extensions["admin_dispatcher"] = app.wsgi_app
@@ -2,13 +2,37 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+import click
 from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask.cli import ScriptInfo
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import APIException, generate_sitemap, swagger_spec
 from admin import setup_admin
-from models import db, User, People, Planet, Favorite
+from models import db, User, People, Planet, Favorite, FAVORITE_MODELS
+from pagination import paginate, parse_limit
+from streaming import wants_stream, stream_ndjson
+from favorites import user_favorites, top_favorites
+import favorite_counts
+from favorite_counts import reconcile_favorite_counts_command
+import write_behind
+import versions
+from write_behind import favorite_writes
+from explain import check_query_plans_command
+from database import engine_options, configure_engine, pool_stats
+import replicas
+import profiling
+import metrics
+import compression
+from replicas import read_session
+from conditional import conditional
+from sync import changes_since, record_deletion, prune_tombstones_command
+from ingest import ingest_command
+from cache import response_cache, object_cache
+from serializers import serializer_for, json_response
+from filters import filtered
+from includes import parse_includes, include_fields, embed
+from bulk import bulk_insert, bulk_response, parse_chunk_size, update_by_ids, bulk_update, bulk_delete, parse_ids, commit_or_conflict
+from sqlalchemy.exc import IntegrityError
 
 
 app = Flask(__name__)
@@ -20,11 +44,29 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# Flask-Migrate pulls in alembic, only the `flask db` commands need it. They run under the flask CLI,
+# whose click context carries a ScriptInfo, other click programs loading the app (uvicorn) do not
+cli_context = click.get_current_context(silent=True)
+if cli_context is not None and cli_context.find_object(ScriptInfo) is not None:
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db)
 db.init_app(app)
+with app.app_context():
+    configure_engine(db.engine)
+replicas.init_app(app)
+versions.init_app(app)
+profiling.init_app(app)
+metrics.init_app(app)
+compression.init_app(app)
+write_behind.init_app(app)
 CORS(app)
 setup_admin(app)
+app.cli.add_command(check_query_plans_command)
+app.cli.add_command(prune_tombstones_command)
+app.cli.add_command(ingest_command)
+app.cli.add_command(reconcile_favorite_counts_command)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -36,19 +78,24 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
+# swagger spec of the endpoints, flask_swagger is imported on the first call (see utils.py)
+@app.route('/swagger.json')
+def get_swagger():
+    return jsonify(swagger_spec(app))
+
 
 #region Summary of All APIs
 # APIs for:
 #   People
 #   * GET people - done
-#   * GET individual people
+#   * GET individual people - done
 #   * POST people - done
 #   * PUT people - done
 #   * DELETE people - done
 #   
 #   Planets
 #   * GET planets - done
-#   * GET individual planet
+#   * GET individual planet - done
 #   * POST planet - done
 #   * PUT planet - done
 #   * DELETE planet - done
@@ -56,39 +103,96 @@ def sitemap():
 #   Users
 #   * POST users - done
 #   * GET users - done
-#   * GET users favorites
+#   * GET users favorites - done
 #
 #   Favorites
 #   * POST favorite - done
 #   * DELETE favorite - done
+#   * GET most favorited items - done
+#
+#   Every collection GET is keyset paginated: ?limit=&cursor=&sort=<indexed column, - for descending>,
+#   follow "next_cursor" from the response until it is null (see pagination.py)
+#   or ask for the whole table as NDJSON with ?stream=1 (see streaming.py).
+#   ?fields=id,name only selects and returns those columns (see serializers.py).
+#   Filter with ?eye_color=blue, ?home_planet_id__in=1,2, ?population__gte=1000
+#   and search names with ?q=sky (see filters.py and search.py).
+#   ?include=home_planet on /people and ?include=residents on /planet embed the related rows (see includes.py)
+#   They also send ETag/Last-Modified and answer conditional GETs with a 304 (see conditional.py)
+#   and ?since=<ISO timestamp> returns only the rows changed and the ids deleted since then (see sync.py).
+#   Pages are cached in process until a write to the same resource commits, single
+#   people and planets are kept in a per process object cache (see cache.py)
+#
+#   POST people/planet/favorite also take a JSON array and insert it in chunks in one transaction,
+#   PATCH updates single rows partially and PATCH/DELETE on /people, /planet and /favorites
+#   update or delete a batch of ids with one statement (see bulk.py)
+#
+#   `uvicorn asgi:application --app-dir src` serves the collection GETs and single
+#   people/planets on an async engine and hands the rest to this app (see asgi.py)
+#   PROFILING=1 (or PROFILING=header and X-Profile: 1) adds Server-Timing headers with
+#   the SQL and serialization time of each request and logs them (see profiling.py)
+#   GET /metrics exposes request counts, latency histograms, pool and cache numbers
+#   to Prometheus, aggregated across gunicorn workers (see metrics.py)
+#   Responses over 1KB are sent brotli/gzip encoded when the client accepts it (see compression.py)
+#   and Accept: application/msgpack returns the read payloads as MessagePack (see serializers.py)
+#   `flask ingest --planets ... --people ... --favorites ...` bulk loads SWAPI dumps (see ingest.py)
+#   FAVORITES_WRITE_BEHIND=1 queues single favorite adds/removes and commits them in batches
+#   from a background thread, answering 202 (see write_behind.py)
+#   GET /favorites/top?type=people&limit=10 ranks items by favorite count, kept per item in
+#   favorite_count by every favorite write, `flask reconcile-favorite-counts` fixes drift (see favorite_counts.py)
+#   /admin is built by its first request and /swagger.json imports flask_swagger on first use,
+#   ENABLE_ADMIN=0 / ENABLE_SWAGGER=0 turn them off and Flask-Migrate is only loaded by the
+#   flask CLI, keeping worker boots short (see admin.py, benchmarks/startup.py)
 
 #endregion Summary of All APIs
 
 #region People
 #   * GET people
 @app.route('/people', methods=['GET'])
+@response_cache.cached("people")
+@conditional(People)
 def get_people():
-    people = People.query.all()
-    all_people = list(map(lambda person: person.serialize(),people))
+    if wants_stream(request):
+        return stream_ndjson(People, request.args)
+
+    if "since" in request.args:
+        response_body = dict(msg="You're in get_people", **changes_since(People, request.args))
+        return json_response(response_body), 200
+
+    includes = parse_includes(People, request.args)
+    serializer = serializer_for(People, include_fields(request.args.get("fields"), includes))
+    stmt = filtered(People, serializer.select(), request.args)
+    people, next_cursor = paginate(People, request.args, stmt=stmt)
+    all_people = embed(serializer.rows(people), includes)
 
     response_body = {
         "msg": "You're in get_people",
-        "data": all_people
+        "data": all_people,
+        "next_cursor": next_cursor
     }
-    return jsonify(response_body), 200
+    return json_response(response_body), 200
 
 #   * GET individual person
 @app.route('/people/<int:people_id>', methods=['GET'])
 def get_individual_person(people_id):
+    item = object_cache.load(People, people_id)
+    if item is None:
+        raise APIException(f"Person {people_id} not found", status_code=404)
+
     response_body = {
-        "msg": f"You're in get_individual_person with ID {people_id}"
+        "msg": f"You're in get_individual_person with ID {people_id}",
+        "data": item
     }
-    return jsonify(response_body), 200
+    return json_response(response_body), 200
 
 #   * POST people
 @app.route('/people', methods=['POST'])
 def post_person():
     data = request.get_json()
+    if isinstance(data, list):
+        results = bulk_insert(People, data, ("name", "age", "eye_color", "home_planet_id"), parse_chunk_size(request.args))
+        response_cache.invalidate("people")
+        object_cache.evict_model(People, missing_only=True)
+        return bulk_response("You're in post_person", results)
 
     name = data["name"]
     age = data["age"]
@@ -99,6 +203,8 @@ def post_person():
 
     db.session.add(new_person)
     db.session.commit()
+    response_cache.invalidate("people")
+    object_cache.evict_model(People, missing_only=True)
 
     response_body = {
         "msg": f"You're in post_person",
@@ -123,6 +229,8 @@ def put_person(people_id):
     person.home_planet_id = home_planet_id
 
     db.session.commit()
+    response_cache.invalidate("people")
+    object_cache.set(People, people_id, serializer_for(People).instance(person))
     response_body = {
         "msg": f"You're in put_person with ID {people_id}",
         "received_data": data
@@ -134,33 +242,99 @@ def put_person(people_id):
 def delete_individual_person(people_id):
     person = People.query.get(people_id)
     db.session.delete(person)
+    record_deletion(People, [people_id])
     db.session.commit()
+    response_cache.invalidate("people")
+    object_cache.evict(People, people_id)
     
     response_body = {
         "msg": f"You have deleted person: {people_id}"
     }
     return jsonify(response_body), 200
+
+#   * PATCH individual person
+@app.route('/people/<int:people_id>', methods=['PATCH'])
+def patch_person(people_id):
+    data = request.get_json()
+
+    if update_by_ids(People, [people_id], data) == 0:
+        raise APIException(f"Person {people_id} not found", status_code=404)
+    commit_or_conflict()
+    response_cache.invalidate("people")
+    object_cache.evict(People, people_id)
+
+    response_body = {
+        "msg": f"You're in patch_person with ID {people_id}",
+        "received_data": data
+    }
+    return jsonify(response_body), 200
+
+#   * PATCH people in batch
+@app.route('/people', methods=['PATCH'])
+def patch_people():
+    data = request.get_json()
+
+    updated = bulk_update(People, data)
+    response_cache.invalidate("people")
+    object_cache.evict_model(People)
+
+    response_body = {
+        "msg": "You're in patch_people",
+        "updated": updated
+    }
+    return jsonify(response_body), 200
+
+#   * DELETE people in batch
+@app.route('/people', methods=['DELETE'])
+def delete_people():
+    deleted = bulk_delete(People, parse_ids(request.args.get("ids")))
+    response_cache.invalidate("people")
+    object_cache.evict(People, *deleted)
+
+    response_body = {
+        "msg": f"You have deleted people: {deleted}",
+        "deleted": deleted
+    }
+    return jsonify(response_body), 200
 #endregion People
 
 #region Planets
 #   * GET Planets
 @app.route('/planet', methods=['GET'])
+@response_cache.cached("planet")
+@conditional(Planet)
 def get_planet():
-    planets = Planet.query.all()
-    all_planets = list(map(lambda planet: planet.serialize(),planets))
+    if wants_stream(request):
+        return stream_ndjson(Planet, request.args)
+
+    if "since" in request.args:
+        response_body = dict(msg="You're in get_people", **changes_since(Planet, request.args))
+        return json_response(response_body), 200
+
+    includes = parse_includes(Planet, request.args)
+    serializer = serializer_for(Planet, include_fields(request.args.get("fields"), includes))
+    stmt = filtered(Planet, serializer.select(), request.args)
+    planets, next_cursor = paginate(Planet, request.args, stmt=stmt)
+    all_planets = embed(serializer.rows(planets), includes)
     response_body = {
         "msg": "You're in get_people",
-        "data": all_planets
+        "data": all_planets,
+        "next_cursor": next_cursor
     }
-    return jsonify(response_body), 200
+    return json_response(response_body), 200
 
 #   * GET individual pplanet
 @app.route('/planet/<int:planet_id>', methods=['GET'])
 def get_individual_planet(planet_id):
+    item = object_cache.load(Planet, planet_id)
+    if item is None:
+        raise APIException(f"Planet {planet_id} not found", status_code=404)
+
     response_body = {
-        "msg": f"You're in get_individual_planet with ID {planet_id}"
+        "msg": f"You're in get_individual_planet with ID {planet_id}",
+        "data": item
     }
-    return jsonify(response_body), 200
+    return json_response(response_body), 200
 
 #   * POST planet
 @app.route('/planet', methods=['POST'])
@@ -178,6 +352,11 @@ def post_planet():
     ```
     """
     data = request.get_json()
+    if isinstance(data, list):
+        results = bulk_insert(Planet, data, ("name", "climate", "population"), parse_chunk_size(request.args))
+        response_cache.invalidate("planet")
+        object_cache.evict_model(Planet, missing_only=True)
+        return bulk_response("You're in post_planet", results)
 
     name = data["name"]
     climate = data["climate"]
@@ -187,6 +366,8 @@ def post_planet():
 
     db.session.add(new_planet)
     db.session.commit()
+    response_cache.invalidate("planet")
+    object_cache.evict_model(Planet, missing_only=True)
     response_body = {
         "msg": f"You're in post_planet",
         "received_data": data
@@ -208,6 +389,8 @@ def put_planet(planet_id):
     planet.population = population
 
     db.session.commit()
+    response_cache.invalidate("planet")
+    object_cache.set(Planet, planet_id, serializer_for(Planet).instance(planet))
     response_body = {
         "msg": f"You're in put_planet with ID {planet_id}",
         "received_data": data
@@ -219,12 +402,60 @@ def put_planet(planet_id):
 def delete_individual_planet(planet_id):
     planet = Planet.query.get(planet_id)
     db.session.delete(planet)
+    record_deletion(Planet, [planet_id])
     db.session.commit()
+    response_cache.invalidate("planet")
+    object_cache.evict(Planet, planet_id)
     
     response_body = {
         "msg": f"You have deleted planet: {planet_id}"
     }
     return jsonify(response_body), 200
+
+#   * PATCH individual planet
+@app.route('/planet/<int:planet_id>', methods=['PATCH'])
+def patch_planet(planet_id):
+    data = request.get_json()
+
+    if update_by_ids(Planet, [planet_id], data) == 0:
+        raise APIException(f"Planet {planet_id} not found", status_code=404)
+    commit_or_conflict()
+    response_cache.invalidate("planet")
+    object_cache.evict(Planet, planet_id)
+
+    response_body = {
+        "msg": f"You're in patch_planet with ID {planet_id}",
+        "received_data": data
+    }
+    return jsonify(response_body), 200
+
+#   * PATCH planets in batch
+@app.route('/planet', methods=['PATCH'])
+def patch_planets():
+    data = request.get_json()
+
+    updated = bulk_update(Planet, data)
+    response_cache.invalidate("planet")
+    object_cache.evict_model(Planet)
+
+    response_body = {
+        "msg": "You're in patch_planets",
+        "updated": updated
+    }
+    return jsonify(response_body), 200
+
+#   * DELETE planets in batch
+@app.route('/planet', methods=['DELETE'])
+def delete_planets():
+    deleted = bulk_delete(Planet, parse_ids(request.args.get("ids")))
+    response_cache.invalidate("planet")
+    object_cache.evict(Planet, *deleted)
+
+    response_body = {
+        "msg": f"You have deleted planets: {deleted}",
+        "deleted": deleted
+    }
+    return jsonify(response_body), 200
 #endregion Planets
 
 #region Users
@@ -240,6 +471,7 @@ def post_user():
 
     db.session.add(new_user)
     db.session.commit()
+    response_cache.invalidate("users")
 
     response_body = {
         "msg": f"You're in post_user",
@@ -249,15 +481,39 @@ def post_user():
 
 #   * GET users
 @app.route('/users', methods=['GET'])
+@response_cache.cached("users")
+@conditional(User)
 def get_users():
-    users = User.query.all()
-    all_users = list(map(lambda user: user.serialize(),users))
+    if wants_stream(request):
+        return stream_ndjson(User, request.args)
+
+    if "since" in request.args:
+        response_body = dict(msg="You're in get_users", **changes_since(User, request.args))
+        return json_response(response_body), 200
+
+    serializer = serializer_for(User, request.args.get("fields"))
+    stmt = filtered(User, serializer.select(), request.args)
+    users, next_cursor = paginate(User, request.args, stmt=stmt)
+    all_users = serializer.rows(users)
 
     response_body = {
         "msg": "You're in get_users",
-        "data": all_users
+        "data": all_users,
+        "next_cursor": next_cursor
     }
-    return jsonify(response_body), 200
+    return json_response(response_body), 200
+
+#   * GET users favorites
+@app.route('/users/<int:user_id>/favorites', methods=['GET'])
+def get_user_favorites(user_id):
+    if read_session().get(User, user_id) is None:
+        raise APIException(f"User {user_id} not found", status_code=404)
+
+    response_body = {
+        "msg": f"You're in get_user_favorites with ID {user_id}",
+        "data": user_favorites(user_id, favorite_writes.pending_for(user_id))
+    }
+    return json_response(response_body), 200
 
 #endregion Users
 
@@ -265,29 +521,78 @@ def get_users():
 
 #   * GET Favorites
 @app.route('/favorites', methods=['GET'])
+@response_cache.cached("favorites")
+@conditional(Favorite)
 def get_favorites():
-    favorites = Favorite.query.all()
-    all_favorites = list(map(lambda favorites: favorites.serialize(),favorites))
+    if wants_stream(request):
+        return stream_ndjson(Favorite, request.args)
+
+    if "since" in request.args:
+        response_body = dict(msg="You're in get_favorites", **changes_since(Favorite, request.args))
+        return json_response(response_body), 200
+
+    serializer = serializer_for(Favorite, request.args.get("fields"))
+    stmt = filtered(Favorite, serializer.select(), request.args)
+    favorites, next_cursor = paginate(Favorite, request.args, stmt=stmt)
+    all_favorites = serializer.rows(favorites)
     response_body = {
         "msg": "You're in get_favorites",
-        "data": all_favorites
+        "data": all_favorites,
+        "next_cursor": next_cursor
     }
-    return jsonify(response_body), 200
+    return json_response(response_body), 200
+
+
+#   * GET most favorited items
+@app.route('/favorites/top', methods=['GET'])
+def get_top_favorites():
+    type = request.args.get("type", "people")
+    if type not in FAVORITE_MODELS:
+        raise APIException(f"type must be one of: {', '.join(FAVORITE_MODELS)}", status_code=400)
+
+    response_body = {
+        "msg": "You're in get_top_favorites",
+        "data": top_favorites(type, parse_limit(request.args))
+    }
+    return json_response(response_body), 200
 
 
 # POST Favorite
 @app.route('/favorite', methods=['POST'])
 def post_favorite():
     data = request.get_json()
+    if isinstance(data, list):
+        results = bulk_insert(Favorite, data, ("type", "user_id", "item_id"), parse_chunk_size(request.args),
+                              commit=False)
+        favorite_counts.added((data[result["index"]]["type"], data[result["index"]]["item_id"])
+                              for result in results if result["status"] == "created")
+        db.session.commit()
+        response_cache.invalidate("favorites")
+        return bulk_response("You're in post_favorite", results)
 
     type = data["type"]
     user_id = data["user_id"]
     item_id = data["item_id"]
 
+    if favorite_writes.enabled:
+        favorite_writes.add(user_id, type, item_id)
+        response_body = {
+            "msg": f"You're in post_favorite",
+            "received_data": data,
+            "pending": True
+        }
+        return jsonify(response_body), 202
+
     new_favorite = Favorite(type=type, user_id=user_id,item_id=item_id)
 
     db.session.add(new_favorite)
-    db.session.commit()
+    try:
+        favorite_counts.added([(type, item_id)])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise APIException(f"User {user_id} already has {type} {item_id} as a favorite", status_code=409)
+    response_cache.invalidate("favorites")
 
     response_body = {
         "msg": f"You're in post_favorite",
@@ -300,16 +605,110 @@ def post_favorite():
 @app.route('/favorite/<int:favorite_id>', methods=['DELETE'])
 def delete_favorite(favorite_id):
     favorite = Favorite.query.get(favorite_id)
+
+    if favorite_writes.enabled:
+        if favorite is None:
+            raise APIException(f"Favorite {favorite_id} not found", status_code=404)
+        favorite_writes.remove(favorite.user_id, favorite.type, favorite.item_id)
+        response_body = {
+            "msg": f"You have deleted planet: {favorite_id}",
+            "pending": True
+        }
+        return jsonify(response_body), 202
+
     db.session.delete(favorite)
+    record_deletion(Favorite, [favorite_id])
+    favorite_counts.removed([(favorite.type, favorite.item_id)])
     db.session.commit()
+    response_cache.invalidate("favorites")
     
     response_body = {
         "msg": f"You have deleted planet: {favorite_id}"
     }
     return jsonify(response_body), 200
+
+#   * PATCH individual favorite
+@app.route('/favorite/<int:favorite_id>', methods=['PATCH'])
+def patch_favorite(favorite_id):
+    data = request.get_json()
+
+    with favorite_counts.counting_moves([favorite_id]):
+        if update_by_ids(Favorite, [favorite_id], data) == 0:
+            raise APIException(f"Favorite {favorite_id} not found", status_code=404)
+    commit_or_conflict()
+    response_cache.invalidate("favorites")
+
+    response_body = {
+        "msg": f"You're in patch_favorite with ID {favorite_id}",
+        "received_data": data
+    }
+    return jsonify(response_body), 200
+
+#   * PATCH favorites in batch
+@app.route('/favorites', methods=['PATCH'])
+def patch_favorites():
+    data = request.get_json()
+
+    with favorite_counts.counting_moves(favorite_counts.patched_ids(data)):
+        updated = bulk_update(Favorite, data, commit=False)
+    commit_or_conflict()
+    response_cache.invalidate("favorites")
+
+    response_body = {
+        "msg": "You're in patch_favorites",
+        "updated": updated
+    }
+    return jsonify(response_body), 200
+
+#   * DELETE favorites in batch
+@app.route('/favorites', methods=['DELETE'])
+def delete_favorites():
+    ids = parse_ids(request.args.get("ids"))
+    keys = favorite_counts.keys_of(ids)
+    deleted = bulk_delete(Favorite, ids, commit=False)
+    favorite_counts.removed(keys[id] for id in deleted)
+    commit_or_conflict()
+    response_cache.invalidate("favorites")
+
+    response_body = {
+        "msg": f"You have deleted favorites: {deleted}",
+        "deleted": deleted
+    }
+    return jsonify(response_body), 200
 #endregion Favorites
 
 
+#region Operations
+#   * GET response cache stats
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    response_body = {
+        "msg": "You're in get_cache_stats",
+        "data": {
+            "responses": response_cache.stats(),
+            "objects": object_cache.stats()
+        }
+    }
+    return jsonify(response_body), 200
+
+#   * GET database pool stats
+@app.route('/db/pool', methods=['GET'])
+def get_db_pool():
+    response_body = {
+        "msg": "You're in get_db_pool",
+        "data": dict(pool_stats(db.engine), replicas=replicas.router.stats(),
+                     favorite_writes=favorite_writes.stats())
+    }
+    return jsonify(response_body), 200
+
+#   * GET Prometheus metrics
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    body, content_type = metrics.render()
+    return body, 200, {"Content-Type": content_type}
+#endregion Operations
+
+
 #################################################################################
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
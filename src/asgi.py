@@ -0,0 +1,307 @@
+"""
+ASGI entry point: `uvicorn asgi:application --app-dir src`.
+
+The hot read routes (collection pages and single people/planets) are served
+natively on SQLAlchemy's AsyncSession (asyncpg / aiosqlite), so a worker
+keeps serving other requests while it waits on the database. They build the
+same statements as the Flask views (filters, sorting, sparse fieldsets,
+keyset cursors) and answer conditional GETs the same way.
+
+Everything else is handed to the Flask app through asgiref's WSGI adapter,
+including reads that need sync-only machinery: NDJSON streaming, delta sync,
+includes and name search. The in-process response and object caches are not
+consulted on the native path, it is meant for database bound workloads.
+Reads go to the DATABASE_REPLICA_URLS replicas round-robin, skipping the
+unhealthy ones, with the read-your-writes rules of replicas.py: the
+read_primary_until cookie set by writes (which Flask serves) and
+X-Read-Consistency: primary keep a client on the primary. Health checks run
+as background tasks, and a replica failing mid request is marked down and
+the read repeated on the primary.
+Native responses carry the CORS header flask-cors adds to the Flask ones,
+preflight OPTIONS requests are answered by Flask. They are counted in the
+/metrics request series under the rule of the Flask route they stand in for.
+Responses are negotiated like the Flask ones: MessagePack for
+`Accept: application/msgpack` and brotli/gzip per Accept-Encoding (see
+serializers.py and compression.py).
+"""
+import os
+import re
+import time
+import asyncio
+import itertools
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError, InterfaceError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.datastructures import MultiDict, MIMEAccept, Accept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags, parse_date, http_date, parse_cookie
+from app import app as flask_app
+from utils import APIException
+from models import User, People, Planet, Favorite
+from serializers import serializer_for, negotiate, encode, msgpack, JSON_MIMETYPE
+from compression import choose_encoding, compress, COMPRESSION_ENABLED
+from filters import filtered
+from pagination import page_statement
+from conditional import validators_statement, validators_from_row, is_not_modified
+from database import engine_options, _set_sqlite_pragmas
+import metrics
+from metrics import METRICS_ENABLED
+import replicas
+from replicas import must_read_primary, RYW_COOKIE, REPLICA_HEALTH_INTERVAL, REPLICA_CONNECT_TIMEOUT
+
+LIST_ROUTES = {
+    "/people": (People, "You're in get_people"),
+    "/planet": (Planet, "You're in get_people"),
+    "/users": (User, "You're in get_users"),
+    "/favorites": (Favorite, "You're in get_favorites"),
+}
+DETAIL_ROUTE = re.compile(r"^/(people|planet)/(\d+)/?$")
+DETAIL_MODELS = {
+    "people": (People, "Person", "You're in get_individual_person with ID {}"),
+    "planet": (Planet, "Planet", "You're in get_individual_planet with ID {}"),
+}
+# query parameters only the Flask views implement
+DELEGATED_PARAMS = {"stream", "since", "include", "q"}
+
+
+def async_url(url):
+    url = url.replace("postgres://", "postgresql://")
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+def async_engine_options(url):
+    options = engine_options(url)
+    # the async engine brings its own (async adapted) queue pool
+    options.pop("poolclass")
+    if "connect_args" in options:
+        timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 30000))
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(timeout)}}
+    return options
+
+
+def create_engine_for(url, **connect_args):
+    options = async_engine_options(url)
+    if connect_args:
+        options["connect_args"] = dict(options.get("connect_args", {}), **connect_args)
+    engine = create_async_engine(async_url(url), **options)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+database_url = flask_app.config["SQLALCHEMY_DATABASE_URI"]
+engine = create_engine_for(database_url)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+class AsyncReplica:
+    def __init__(self, url):
+        # asyncpg's connect timeout, so a blackholed replica fails fast
+        connect_args = {"timeout": REPLICA_CONNECT_TIMEOUT} if url.startswith("postgresql") else {}
+        self.engine = create_engine_for(url, **connect_args)
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.healthy = True
+        self.checked_at = float("-inf")
+        self._check = None
+
+    def mark_down(self):
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    async def check(self):
+        try:
+            async with self.engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+    def check_in_background(self):
+        if self._check is None or self._check.done():
+            self._check = asyncio.create_task(self.check())
+
+
+# the replicas replicas.init_app() configured from DATABASE_REPLICA_URLS
+async_replicas = [AsyncReplica(replica.engine.url.render_as_string(hide_password=False))
+                  for replica in replicas.router.replicas]
+_next_replica = itertools.count()
+
+
+def pick_replica(request):
+    """The replica to read from: a healthy one, unless the client must read its writes."""
+    cookie = parse_cookie(request.headers.get("cookie", "")).get(RYW_COOKIE)
+    if not async_replicas or must_read_primary("GET", request.headers.get("x-read-consistency"), cookie):
+        return None
+    for _ in range(len(async_replicas)):
+        replica = async_replicas[next(_next_replica) % len(async_replicas)]
+        if time.monotonic() - replica.checked_at > REPLICA_HEALTH_INTERVAL:
+            replica.check_in_background()
+        if replica.healthy:
+            return replica
+    return None
+
+
+async def read(request, query):
+    """`await query(session)` on the request's replica, or on the primary if there is none or it fails."""
+    replica = pick_replica(request)
+    if replica is not None:
+        try:
+            async with replica.Session() as session:
+                return await query(session)
+        except (OperationalError, InterfaceError):
+            replica.mark_down()
+    async with Session() as session:
+        return await query(session)
+
+wsgi_application = WsgiToAsgi(flask_app)
+url_adapter = flask_app.url_map.bind("localhost")
+
+
+class Request:
+    def __init__(self, scope):
+        self.path = scope["path"]
+        self.query_string = scope["query_string"].decode("latin-1")
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1")
+                        for name, value in scope["headers"]}
+        self.accept_mimetypes = parse_accept_header(self.headers.get("accept"), MIMEAccept)
+        self.accept_encodings = parse_accept_header(self.headers.get("accept-encoding"), Accept)
+
+
+def cors_headers(request):
+    # what CORS(app) in app.py sends: the Origin echoed back, * without one
+    return [("access-control-allow-origin", request.headers.get("origin", "*"))]
+
+
+async def send_response(send, request, status, payload=None, headers=(), mimetype=None):
+    """Encode `payload` as negotiated (or as `mimetype`) and send it, compressed when worth it."""
+    headers = list(headers) + cors_headers(request)
+    vary = ["Accept"] if msgpack is not None else []
+    if COMPRESSION_ENABLED:
+        vary.append("Accept-Encoding")
+    body = b""
+    if status != 304:
+        mimetype = mimetype or negotiate(request.accept_mimetypes)
+        body = encode(payload, mimetype)
+        headers.append(("content-type", mimetype))
+        encoding = choose_encoding(request.accept_encodings, mimetype, len(body))
+        if encoding is not None:
+            body = compress(body, encoding)
+            headers.append(("content-encoding", encoding))
+    if vary:
+        headers.append(("vary", ", ".join(vary)))
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def list_page(request, model, msg):
+    return await read(request, lambda session: query_page(session, request, model, msg))
+
+
+async def query_page(session, request, model, msg):
+    row = (await session.execute(validators_statement(model))).one()
+    etag, last_modified = validators_from_row(model, row, request.query_string, request.accept_mimetypes)
+    headers = [("etag", f'W/"{etag}"'), ("cache-control", "no-cache")]
+    if last_modified is not None:
+        headers.append(("last-modified", http_date(last_modified)))
+
+    if_none_match = parse_etags(request.headers.get("if-none-match"))
+    if_modified_since = parse_date(request.headers.get("if-modified-since"))
+    if is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+        return 304, None, headers
+
+    serializer = serializer_for(model, request.args.get("fields"))
+    stmt, finish = page_statement(model, request.args, filtered(model, serializer.select(), request.args))
+    rows, next_cursor = finish((await session.execute(stmt)).all())
+    return 200, {"msg": msg, "data": serializer.rows(rows), "next_cursor": next_cursor}, headers
+
+
+async def detail(request, model, label, msg, id):
+    serializer = serializer_for(model)
+
+    async def query(session):
+        return (await session.execute(serializer.select().where(model.id == id))).first()
+
+    row = await read(request, query)
+    if row is None:
+        raise APIException(f"{label} {id} not found", status_code=404)
+    return 200, {"msg": msg.format(id), "data": serializer.row(row)}, []
+
+
+def rule_of(path):
+    """The rule of the Flask route `path` would have been served by, the /metrics endpoint label."""
+    try:
+        rule, _ = url_adapter.match(path, "GET", return_rule=True)
+    except HTTPException:
+        return "unmatched"
+    return rule.rule
+
+
+def native_handler(scope, request):
+    """The coroutine serving this request natively, None to hand it to Flask."""
+    if scope["method"] != "GET" or DELEGATED_PARAMS.intersection(request.args):
+        return None
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return None
+
+    path = request.path.rstrip("/") or "/"
+    if path in LIST_ROUTES:
+        model, msg = LIST_ROUTES[path]
+        return list_page(request, model, msg)
+
+    match = DETAIL_ROUTE.match(request.path)
+    if match:
+        model, label, msg = DETAIL_MODELS[match.group(1)]
+        return detail(request, model, label, msg, int(match.group(2)))
+    return None
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await engine.dispose()
+            for replica in async_replicas:
+                await replica.engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        raise RuntimeError(f"Unsupported ASGI scope {scope['type']}")
+
+    request = Request(scope)
+    # statements and encoders look at current_app/db.engine, so build them in an app context
+    with flask_app.app_context():
+        handler = native_handler(scope, request)
+        if handler is None:
+            return await wsgi_application(scope, receive, send)
+        started = metrics.start_request("GET", rule_of(request.path)) if METRICS_ENABLED else None
+        status = 500
+        try:
+            try:
+                status, payload, headers = await handler
+                mimetype = None
+            except APIException as error:
+                # errors are JSON whatever the Accept header, like the Flask error handler's
+                status, payload, headers, mimetype = error.status_code, error.to_dict(), [], JSON_MIMETYPE
+            await send_response(send, request, status, payload, headers, mimetype)
+        finally:
+            if started is not None:
+                metrics.finish_request(started, status)
+                metrics.process_metrics.sync()
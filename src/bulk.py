@@ -0,0 +1,216 @@
+"""
+Bulk create, update and delete support.
+
+When a POST body is a JSON array the rows are validated, then written with
+multi-row `INSERT ... RETURNING id` statements of BULK_CHUNK_SIZE rows in a
+single transaction. Every chunk runs in a savepoint: if one fails, its rows
+are retried one by one so only the offending rows are reported as errors.
+
+PATCH and DELETE run as set based `UPDATE/DELETE ... WHERE id IN (...)`
+statements (or an executemany UPDATE keyed by id), no ORM object is loaded.
+"""
+import os
+from flask import jsonify
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, StatementError
+from utils import APIException
+from models import db
+from sync import record_deletion
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 1000))
+
+
+def parse_chunk_size(args):
+    try:
+        chunk_size = int(args.get("chunk_size", BULK_CHUNK_SIZE))
+    except ValueError:
+        raise APIException("chunk_size must be an integer", status_code=400)
+    if chunk_size < 1:
+        raise APIException("chunk_size must be greater than 0", status_code=400)
+    return chunk_size
+
+
+def _created(index, id):
+    return {"index": index, "status": "created", "id": id}
+
+
+def _failed(index, error):
+    return {"index": index, "status": "error", "error": error}
+
+
+def _insert_one_by_one(model, chunk, results):
+    for index, values in chunk:
+        try:
+            with db.session.begin_nested():
+                id = db.session.scalar(insert(model).values(**values).returning(model.id))
+            results[index] = _created(index, id)
+        # constraint violations, and values the driver or the column type rejects
+        except StatementError as error:
+            results[index] = _failed(index, str(error.orig))
+
+
+def _insert_returning_ids(model, values):
+    """INSERT `values` as multi-row statements, returns the new ids in the order of `values`."""
+    if db.engine.dialect.name == "sqlite":
+        # ordered RETURNING would run one INSERT per row here, and SQLite numbers
+        # the rows of a multi-row INSERT in VALUES order anyway
+        return sorted(db.session.scalars(insert(model).returning(model.id), values).all())
+    return db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), values).all()
+
+
+def bulk_insert(model, rows, fields, chunk_size=BULK_CHUNK_SIZE, commit=True):
+    """
+    Insert `rows` (a list of dicts carrying `fields`) and commit once.
+
+    Returns one result per input row, in input order. With commit=False the
+    caller adds to the transaction and commits it.
+    """
+    results = [None] * len(rows)
+    valid = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results[index] = _failed(index, "Row must be a JSON object")
+            continue
+        missing = [field for field in fields if field not in row]
+        if missing:
+            results[index] = _failed(index, f"Missing fields: {', '.join(missing)}")
+            continue
+        valid.append((index, {field: row[field] for field in fields}))
+
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            with db.session.begin_nested():
+                ids = _insert_returning_ids(model, [values for _, values in chunk])
+        except StatementError:
+            _insert_one_by_one(model, chunk, results)
+            continue
+        for (index, _), id in zip(chunk, ids):
+            results[index] = _created(index, id)
+
+    if commit:
+        db.session.commit()
+    return results
+
+
+def insert_ignoring_conflicts(model):
+    """An INSERT for `model` that skips rows violating a unique constraint."""
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return insert(model).prefix_with("IGNORE", dialect="mysql")
+
+
+def commit_or_conflict():
+    try:
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        raise APIException(f"Conflict: {error.orig}", status_code=409)
+
+
+def execute_or_conflict(stmt, params=None):
+    """Run an UPDATE/DELETE, a unique or foreign key violation fails it right away, not at commit."""
+    try:
+        return db.session.execute(stmt, params)
+    except IntegrityError as error:
+        db.session.rollback()
+        raise APIException(f"Conflict: {error.orig}", status_code=409)
+
+
+def editable_fields(model):
+    return [column.key for column in model.__table__.columns
+            if column.key not in ("id", "created_at", "updated_at")]
+
+
+def parse_changes(model, data):
+    if not isinstance(data, dict) or not data:
+        raise APIException("Expected a JSON object with the fields to change", status_code=400)
+    unknown = set(data) - set(editable_fields(model))
+    if unknown:
+        raise APIException(f"Unknown or read-only fields: {', '.join(sorted(unknown))}", status_code=400)
+    return data
+
+
+def parse_ids(raw):
+    try:
+        ids = [int(id) for id in raw.split(",") if id.strip()]
+    except (AttributeError, ValueError):
+        raise APIException("ids must be a comma separated list of integers", status_code=400)
+    if not ids:
+        raise APIException("ids is required", status_code=400)
+    return ids
+
+
+def update_by_ids(model, ids, changes):
+    """`UPDATE model SET ... WHERE id IN (ids)`, returns the number of matched rows."""
+    stmt = (
+        update(model)
+        .where(model.id.in_(ids))
+        .values(**parse_changes(model, changes))
+        .execution_options(synchronize_session=False)
+    )
+    return execute_or_conflict(stmt).rowcount
+
+
+def bulk_update(model, data, commit=True):
+    """
+    Apply a batch PATCH body and commit, returns the number of rows updated.
+
+    `{"ids": [1, 2], "set": {...}}` applies the same changes to every id, a list
+    of `{"id": 1, ...}` objects applies per row changes with one executemany.
+    """
+    if isinstance(data, dict) and "ids" in data:
+        ids = data["ids"]
+        if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+            raise APIException("ids must be a list of integers", status_code=400)
+        count = update_by_ids(model, ids, data.get("set"))
+    elif isinstance(data, list) and data:
+        rows = []
+        for row in data:
+            if not isinstance(row, dict) or not isinstance(row.get("id"), int):
+                raise APIException("Every row needs an integer id", status_code=400)
+            changes = {key: value for key, value in row.items() if key != "id"}
+            rows.append(dict(parse_changes(model, changes), id=row["id"]))
+        # existence is checked up front, the executemany rowcount is not reliable on every driver
+        existing = set(db.session.scalars(select(model.id).where(model.id.in_([row["id"] for row in rows]))))
+        rows = [row for row in rows if row["id"] in existing]
+        if rows:
+            execute_or_conflict(update(model), rows)
+        count = len(rows)
+    else:
+        raise APIException('Expected {"ids": [...], "set": {...}} or a list of objects with an id', status_code=400)
+
+    if commit:
+        commit_or_conflict()
+    return count
+
+
+def bulk_delete(model, ids, commit=True):
+    """`DELETE FROM model WHERE id IN (ids)` with tombstones, returns the deleted ids."""
+    stmt = (
+        delete(model)
+        .where(model.id.in_(ids))
+        .returning(model.id)
+        .execution_options(synchronize_session=False)
+    )
+    deleted = execute_or_conflict(stmt).scalars().all()
+    record_deletion(model, deleted)
+    if commit:
+        commit_or_conflict()
+    return deleted
+
+
+def bulk_response(msg, results):
+    failed = sum(1 for result in results if result["status"] == "error")
+    response_body = {
+        "msg": msg,
+        "created": len(results) - failed,
+        "failed": failed,
+        "data": results
+    }
+    # 207 Multi-Status tells the client to look at the per row results
+    return jsonify(response_body), 207 if failed else 201
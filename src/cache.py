@@ -0,0 +1,312 @@
+"""
+Read-through cache of serialized responses.
+
+Collection GETs are cached per route + query string + Accept header and the
+write handlers invalidate their resource's namespace right after they commit.
+Each gunicorn worker has its own LRUCache, so RESPONSE_CACHE_TTL bounds how
+long another worker can serve a stale page. Swap the backend for a shared
+store (anything implementing CacheBackend) to invalidate across workers.
+
+Single resource GETs use an ObjectCache of serialized rows keyed by
+`(table, id)`, bounded by an approximate memory budget. Missing ids are
+cached too (negatively, for a shorter time) so scans for absent ids do not
+reach the database either.
+
+Requests that must read from the primary (see replicas.py) bypass both
+caches, and a replica read right after a local invalidation is not cached.
+Both caches count invalidations per namespace / model: a read that started
+before an invalidation is not stored after it, so a GET racing a write
+cannot put back the data the write just replaced.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from flask import request, make_response, Response
+from replicas import read_session, primary_required, read_from_replica, REPLICA_RYW_WINDOW
+from serializers import serializer_for, dumps
+
+
+class CacheBackend:
+    """Storage interface used by ResponseCache."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache with a per entry time to live."""
+
+    def __init__(self, maxsize=512, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class ResponseCache:
+    def __init__(self, backend, enabled=True):
+        self.backend = backend
+        self.enabled = enabled
+        self.listeners = defaultdict(list)
+        self.dependents = defaultdict(set)
+        self.invalidated_at = {}
+        self.generations = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def key(self, namespace):
+        return f"{namespace}:{request.full_path}|{request.accept_mimetypes}"
+
+    def cached(self, namespace):
+        """Serve GETs of the decorated view from the cache, filling it on a miss."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or primary_required():
+                    return view(*args, **kwargs)
+
+                key = self.key(namespace)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    body, status, headers = entry
+                    response = Response(body, status=status, headers=headers)
+                    # still honour If-None-Match / If-Modified-Since against the cached validators
+                    return response.make_conditional(request)
+
+                generation = self.generations[namespace]
+                response = make_response(view(*args, **kwargs))
+                # 304s have no body and streamed exports are too big to keep
+                if response.status_code == 200 and not response.is_streamed and self._may_fill(namespace):
+                    entry = (response.get_data(), response.status_code, list(response.headers))
+                    with self._lock:
+                        # skipped when a write invalidated the namespace while the view was reading
+                        if self.generations[namespace] == generation:
+                            self.backend.set(key, entry)
+                return response
+            return wrapper
+        return decorator
+
+    def _may_fill(self, namespace):
+        # a replica may not have the write behind the last invalidation yet
+        if not read_from_replica():
+            return True
+        return time.monotonic() - self.invalidated_at.get(namespace, float("-inf")) > REPLICA_RYW_WINDOW
+
+    def subscribe(self, namespace, callback):
+        """Call `callback()` whenever `namespace` is invalidated, for other derived state."""
+        self.listeners[namespace].append(callback)
+
+    def depend(self, namespace, on):
+        """Clear `namespace` whenever `on` is invalidated, for pages that embed rows of `on`."""
+        self.dependents[on].add(namespace)
+
+    def invalidate(self, *namespaces):
+        now = time.monotonic()
+        for namespace in namespaces:
+            with self._lock:
+                for cleared in (namespace, *self.dependents[namespace]):
+                    self.generations[cleared] += 1
+                    self.invalidated_at[cleared] = now
+                    self.backend.delete_prefix(f"{cleared}:")
+            for callback in self.listeners[namespace]:
+                callback()
+
+    def stats(self):
+        return dict(self.backend.stats(), enabled=self.enabled)
+
+
+response_cache = ResponseCache(
+    LRUCache(
+        maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 512)),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", 30)),
+    ),
+    enabled=os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1",
+)
+
+
+class ObjectCache:
+    """LRU of serialized objects keyed by `(table, id)`, bounded by `max_bytes`."""
+
+    # per entry bookkeeping on top of the encoded size
+    OVERHEAD = 256
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=60, negative_ttl=5):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted_at = {}
+        self.generations = defaultdict(int)
+        self.bytes = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _pop(self, key):
+        _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+    def _store(self, key, value, ttl, size, generation=None):
+        with self._lock:
+            if generation is not None and self.generations[key[0]] != generation:
+                return
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (time.monotonic() + ttl, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._data:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def get(self, model, id):
+        """Return `(found, value)`, value is None for a negatively cached id."""
+        key = (model.__tablename__, id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[1]
+
+    def _changed(self, table):
+        # under self._lock
+        self.generations[table] += 1
+        self.evicted_at[table] = time.monotonic()
+
+    def set(self, model, id, value):
+        """Store the row a write just committed, loads still in flight will not overwrite it."""
+        with self._lock:
+            self._changed(model.__tablename__)
+        self._store((model.__tablename__, id), value, self.ttl, len(dumps(value)) + self.OVERHEAD)
+
+    def evict(self, model, *ids):
+        with self._lock:
+            self._changed(model.__tablename__)
+            for id in ids:
+                if (model.__tablename__, id) in self._data:
+                    self._pop((model.__tablename__, id))
+
+    def evict_model(self, model, missing_only=False):
+        """Drop every entry of `model`, or only its negative entries (after inserts)."""
+        with self._lock:
+            self._changed(model.__tablename__)
+            for key, (_, value, _) in list(self._data.items()):
+                if key[0] == model.__tablename__ and (value is None or not missing_only):
+                    self._pop(key)
+
+    def load(self, model, id):
+        """The serialized `model` row `id`, from the cache or the session identity map / database."""
+        primary = primary_required()
+        if not primary:
+            found, value = self.get(model, id)
+            if found:
+                return value
+
+        generation = self.generations[model.__tablename__]
+        instance = read_session().get(model, id)
+        value = None if instance is None else serializer_for(model).instance(instance)
+        if primary or not self._may_fill(model):
+            return value
+        key = (model.__tablename__, id)
+        if value is None:
+            self._store(key, None, self.negative_ttl, self.OVERHEAD, generation)
+        else:
+            self._store(key, value, self.ttl, len(dumps(value)) + self.OVERHEAD, generation)
+        return value
+
+    def _may_fill(self, model):
+        if not read_from_replica():
+            return True
+        return time.monotonic() - self.evicted_at.get(model.__tablename__, float("-inf")) > REPLICA_RYW_WINDOW
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+object_cache = ObjectCache(
+    max_bytes=int(os.getenv("OBJECT_CACHE_BYTES", 16 * 1024 * 1024)),
+    ttl=float(os.getenv("OBJECT_CACHE_TTL", 60)),
+    negative_ttl=float(os.getenv("OBJECT_CACHE_NEGATIVE_TTL", 5)),
+)
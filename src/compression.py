@@ -0,0 +1,106 @@
+"""
+Response compression.
+
+Responses of a compressible media type are encoded with brotli (when the
+brotli package is installed) or gzip, whichever the client's Accept-Encoding
+prefers, once their body reaches COMPRESSION_MIN_SIZE bytes. Streamed
+responses (the NDJSON exports) are compressed chunk by chunk and flushed
+after every batch, so clients still receive rows as they are read.
+
+304s, 204s, HEAD requests and bodies that are already encoded are left alone.
+Levels trade CPU for bytes, see benchmarks/compression.py for the numbers.
+The native ASGI routes (asgi.py) negotiate the same way through
+choose_encoding().
+"""
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/msgpack",
+    "text/html",
+    "text/plain",
+}
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def _gzip_compressor(level):
+    # wbits 31 writes the gzip header and trailer around the deflate stream
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def compress(data, encoding, level=None):
+    """`data` compressed whole with `encoding`."""
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY if level is None else level)
+    compressor = _gzip_compressor(COMPRESSION_GZIP_LEVEL if level is None else level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of chunks, flushing after each one."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = _gzip_compressor(COMPRESSION_GZIP_LEVEL)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+def _encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+def choose_encoding(accept_encodings, mimetype, size):
+    """The Content-Encoding for a whole body of `mimetype` and `size` bytes, None to send it as is."""
+    if not COMPRESSION_ENABLED or mimetype not in COMPRESSIBLE_MIMETYPES or size < COMPRESSION_MIN_SIZE:
+        return None
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def init_app(app):
+    if not COMPRESSION_ENABLED:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or "Content-Encoding" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding")
+        if request.method == "HEAD" or response.status_code in (204, 304) or response.direct_passthrough:
+            return response
+
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            chunks = response.response
+            response.response = compress_stream(_encode(chunks), encoding)
+            if hasattr(chunks, "close"):
+                # closing the response only closes our wrapper, let the export release its cursor too
+                response.call_on_close(chunks.close)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESSION_MIN_SIZE:
+                return response
+            response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,100 @@
+"""
+Conditional GET (ETag / Last-Modified) for the collection endpoints.
+
+The validators come from one cheap aggregate query over the table
+(row count, max(id), max(updated_at), the last tombstone and the table's
+write counter from versions.py), so a client that sends back
+If-None-Match / If-Modified-Since gets a 304 before anything is loaded
+or serialized. The counter tells apart writes within the same second, which
+the timestamps cannot on SQLite. With `?include=` the included table's
+timestamps and counter are part of the validators too.
+"""
+import hashlib
+from datetime import timezone
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy import select, func
+from models import Tombstone
+from replicas import read_session
+from versions import version_column
+from includes import parse_includes, related_models
+
+
+def _last_deleted(model):
+    return (
+        select(func.max(Tombstone.deleted_at))
+        .where(Tombstone.resource == model.__tablename__)
+        .scalar_subquery()
+    )
+
+
+def validators_statement(model, related=()):
+    """
+    count, max(id), max(updated_at), last delete and version of `model`, then
+    max(updated_at), last delete and version of every `related` model.
+    """
+    columns = [func.count(model.id), func.max(model.id), func.max(model.updated_at), _last_deleted(model),
+               version_column(model.__tablename__)]
+    for other in related:
+        columns += [select(func.max(other.updated_at)).scalar_subquery(), _last_deleted(other),
+                    version_column(other.__tablename__)]
+    return select(*columns)
+
+
+def validators_from_row(model, row, query_string, accept):
+    """Turn the validators_statement() row into `(etag, last_modified)`."""
+    count, max_id, *tables = row
+    timestamps = [value for index, value in enumerate(tables) if index % 3 != 2]
+    versions = tables[2::3]
+
+    # a delete does not touch updated_at, so it has to move Last-Modified through its tombstone
+    changed_at = max(filter(None, timestamps), default=None)
+    last_modified = None
+    if changed_at is not None:
+        # updated_at is stored as naive UTC and HTTP dates have second precision
+        last_modified = changed_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+    # the same table state renders differently per page/filter and media type,
+    # the ETag keeps the full precision timestamp
+    state = f"{model.__tablename__}:{count}:{max_id}:{changed_at}:{versions}:{query_string}:{accept}"
+    return hashlib.sha1(state.encode()).hexdigest(), last_modified
+
+
+def collection_validators(model):
+    """Return `(etag, last_modified)` for the current state of `model`'s table."""
+    related = related_models(parse_includes(model, request.args))
+    row = read_session().execute(validators_statement(model, related)).one()
+    return validators_from_row(model, row, request.query_string.decode(), request.accept_mimetypes)
+
+
+def is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+    if if_none_match:
+        # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+        return if_none_match.contains_weak(etag)
+    if if_modified_since and last_modified is not None:
+        return last_modified <= if_modified_since
+    return False
+
+
+def conditional(model):
+    """Answer GETs on a collection of `model` with 304 when the client copy is current."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = collection_validators(model)
+
+            if is_not_modified(etag, last_modified, request.if_none_match, request.if_modified_since):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # let clients keep the payload but revalidate on every poll
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,88 @@
+"""
+EXPLAIN based check for the hot query plans.
+
+`flask check-query-plans` explains the queries our endpoints run on every
+request and exits with status 1 if any of them falls back to a full table
+scan, e.g. because an index went missing in a migration.
+"""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, text
+from models import db, User, People, Planet, Favorite, FavoriteCount
+
+
+def hot_queries():
+    return {
+        "user favorites": select(Favorite).where(Favorite.user_id == 1).order_by(Favorite.id),
+        "favorites of an item": select(Favorite).where(Favorite.type == "people", Favorite.item_id.in_([1, 2])),
+        "most favorited items": (
+            select(FavoriteCount)
+            .where(FavoriteCount.type == "people", FavoriteCount.count > 0)
+            .order_by(FavoriteCount.count.desc(), FavoriteCount.item_id.desc())
+            .limit(10)
+        ),
+        "residents of a planet": select(People).where(People.home_planet_id == 1),
+        "people by updated_at": select(People).order_by(People.updated_at, People.id).limit(100),
+        "planets by updated_at": select(Planet).order_by(Planet.updated_at, Planet.id).limit(100),
+        "users by updated_at": select(User).order_by(User.updated_at, User.id).limit(100),
+        "favorites by updated_at": select(Favorite).order_by(Favorite.updated_at, Favorite.id).limit(100),
+        "people by name": select(People).order_by(People.name, People.id).limit(100),
+        "people by eye_color": select(People).where(People.eye_color == "blue").order_by(People.eye_color, People.id).limit(100),
+        "planets by population": select(Planet).where(Planet.population >= 1000).order_by(Planet.population, Planet.id).limit(100),
+    }
+
+
+def _compile(connection, stmt):
+    return str(stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def _postgres_seq_scans(plan):
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        scans.extend(_postgres_seq_scans(child))
+    return scans
+
+
+def full_scans(connection, stmt):
+    """Return the tables `stmt` reads with a full scan."""
+    sql = _compile(connection, stmt)
+
+    if connection.dialect.name == "postgresql":
+        # tiny tables are always cheaper to seq scan, so ask whether an index path exists at all
+        with connection.begin_nested():
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = connection.execute(text("EXPLAIN (FORMAT JSON) " + sql)).scalar()
+        return _postgres_seq_scans(plan[0]["Plan"])
+
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text("EXPLAIN QUERY PLAN " + sql)).all()
+        # "SCAN people" is a full scan, "SCAN people USING INDEX ..." walks an index in order
+        return [row.detail.split()[1] for row in rows
+                if row.detail.startswith("SCAN ") and " USING " not in row.detail]
+
+    raise click.ClickException(f"EXPLAIN check is not supported on {connection.dialect.name}")
+
+
+def check_query_plans():
+    """Return a `{query name: [tables scanned]}` dict of the failing hot queries."""
+    failures = {}
+    with db.engine.connect() as connection:
+        for name, stmt in hot_queries().items():
+            scans = full_scans(connection, stmt)
+            if scans:
+                failures[name] = scans
+    return failures
+
+
+@click.command("check-query-plans")
+@with_appcontext
+def check_query_plans_command():
+    """Fail if a hot query plan falls back to a sequential scan."""
+    failures = check_query_plans()
+    for name, tables in failures.items():
+        click.echo(f"FAIL {name}: full scan on {', '.join(tables)}", err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo(f"OK {len(hot_queries())} hot queries use indexes")
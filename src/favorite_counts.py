@@ -0,0 +1,137 @@
+"""
+Denormalized favorite counts behind `GET /favorites/top`.
+
+favorite_count holds one row per favorited `(type, item_id)` with the number
+of favorites pointing at it. Every path that adds, removes or moves
+favorites (single and bulk endpoints, the write-behind flusher, `flask
+ingest`) hands its deltas to `apply()` before it commits, which writes them
+as one `INSERT ... ON CONFLICT DO UPDATE SET count = count + excluded.count`,
+so counts commit or roll back together with the favorites they count. The
+leaderboard then reads the first rows of the (type, count, item_id) index
+instead of grouping the favorite table.
+
+`flask reconcile-favorite-counts` recomputes the counts from the favorite
+table and rewrites the ones that drifted, e.g. after favorites were edited
+by hand. It also deletes the rows that removals brought down to 0, without
+reporting them as drift.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, insert, delete, func, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Favorite, FavoriteCount
+
+
+def _upsert(rows, accumulate):
+    """Write `rows` of {"type", "item_id", "count"}, adding to the stored counts or replacing them."""
+    # a fixed order keeps concurrent writers from locking the same counters in opposite orders
+    rows = sorted(rows, key=lambda row: (row["type"], row["item_id"]))
+    dialect = db.engine.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(FavoriteCount)
+        count = FavoriteCount.count + stmt.excluded.count if accumulate else stmt.excluded.count
+        stmt = stmt.on_conflict_do_update(index_elements=["type", "item_id"],
+                                          set_={"count": count, "updated_at": func.now()})
+        db.session.execute(stmt, rows)
+        return
+    for row in rows:
+        count = FavoriteCount.count + row["count"] if accumulate else row["count"]
+        stmt = (
+            update(FavoriteCount)
+            .where(FavoriteCount.type == row["type"], FavoriteCount.item_id == row["item_id"])
+            .values(count=count)
+            .execution_options(synchronize_session=False)
+        )
+        if db.session.execute(stmt).rowcount == 0:
+            db.session.execute(insert(FavoriteCount).values(**row))
+
+
+def apply(deltas):
+    """Add `deltas` ({(type, item_id): change}) to the counts in the current transaction."""
+    rows = [dict(type=type, item_id=item_id, count=change)
+            for (type, item_id), change in deltas.items() if change]
+    if rows:
+        _upsert(rows, accumulate=True)
+
+
+def added(keys):
+    """Count one new favorite per `(type, item_id)` in `keys`."""
+    apply(Counter((type, item_id) for type, item_id in keys))
+
+
+def removed(keys):
+    """Count one deleted favorite per `(type, item_id)` in `keys`."""
+    deltas = Counter()
+    deltas.subtract((type, item_id) for type, item_id in keys)
+    apply(deltas)
+
+
+def keys_of(ids):
+    """`{favorite id: (type, item_id)}` of the favorites in `ids` that exist."""
+    stmt = select(Favorite.id, Favorite.type, Favorite.item_id).where(Favorite.id.in_(list(ids)))
+    return {id: (type, item_id) for id, type, item_id in db.session.execute(stmt)}
+
+
+def patched_ids(data):
+    """The favorite ids a PATCH body (single or batch form) touches, ignoring malformed ones."""
+    if isinstance(data, dict):
+        ids = data.get("ids")
+        return [id for id in ids if isinstance(id, int)] if isinstance(ids, list) else []
+    if isinstance(data, list):
+        return [row["id"] for row in data if isinstance(row, dict) and isinstance(row.get("id"), int)]
+    return []
+
+
+@contextmanager
+def counting_moves(ids):
+    """Move the counts of the favorites `ids` to whatever `(type, item_id)` the block updates them to."""
+    before = keys_of(ids)
+    yield
+    if not before:
+        return
+    deltas = Counter(keys_of(before).values())
+    deltas.subtract(before.values())
+    apply(deltas)
+
+
+def reconcile():
+    """Rewrite the counts that differ from the favorite table, returns how many had drifted."""
+    if db.engine.dialect.name == "postgresql":
+        # writers wait until this commits, so none of their deltas land between the count and the rewrite
+        db.session.execute(text("LOCK TABLE favorite_count IN EXCLUSIVE MODE"))
+    actual = {
+        (type, item_id): count
+        for type, item_id, count in db.session.execute(
+            select(Favorite.type, Favorite.item_id, func.count()).group_by(Favorite.type, Favorite.item_id)
+        )
+    }
+    stored = {
+        (type, item_id): count
+        for type, item_id, count in db.session.execute(
+            select(FavoriteCount.type, FavoriteCount.item_id, FavoriteCount.count)
+        )
+    }
+    drifted = [dict(type=type, item_id=item_id, count=count)
+               for (type, item_id), count in actual.items() if stored.get((type, item_id)) != count]
+    orphans = [key for key in stored if key not in actual]
+    if drifted:
+        _upsert(drifted, accumulate=False)
+    if orphans:
+        db.session.execute(
+            delete(FavoriteCount)
+            .where(tuple_(FavoriteCount.type, FavoriteCount.item_id).in_(orphans))
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    # removals leave counters at 0 behind, those are correct and only cleaned up here
+    return len(drifted) + sum(1 for key in orphans if stored[key] != 0)
+
+
+@click.command("reconcile-favorite-counts")
+@with_appcontext
+def reconcile_favorite_counts_command():
+    """Recompute the favorite counts from the favorite table and fix the ones that drifted."""
+    fixed = reconcile()
+    click.echo(f"Fixed {fixed} favorite counts" if fixed else "Favorite counts are in sync")
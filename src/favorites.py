@@ -0,0 +1,68 @@
+"""
+Helpers for the favorites endpoints.
+"""
+from collections import defaultdict
+from sqlalchemy import select
+from models import Favorite, FavoriteCount, FAVORITE_MODELS
+from replicas import read_session
+from serializers import serializer_for
+from write_behind import ADD, REMOVE
+
+
+def load_favorite_items(favorites):
+    """
+    Hydrate serialized favorites with the People/Planet rows they point at.
+
+    item_ids are grouped by type and each group is loaded with a single
+    `WHERE id IN (...)` query, so the query count only depends on the number
+    of favorite types, never on the number of favorites.
+    """
+    ids_by_type = defaultdict(set)
+    for favorite in favorites:
+        ids_by_type[favorite["type"]].add(favorite["item_id"])
+
+    items = {}
+    for type, ids in ids_by_type.items():
+        model = FAVORITE_MODELS.get(type)
+        if model is None:
+            continue
+        serializer = serializer_for(model)
+        for item in serializer.rows(read_session().execute(serializer.select().where(model.id.in_(ids)))):
+            items[(type, item["id"])] = item
+
+    return [
+        dict(favorite, item=items.get((favorite["type"], favorite["item_id"])))
+        for favorite in favorites
+    ]
+
+
+def user_favorites(user_id, pending=None):
+    """
+    The user's favorites with their items, `pending` being the user's queued
+    write-behind changes `{(type, item_id): operation}` to show on top.
+    """
+    serializer = serializer_for(Favorite)
+    stmt = serializer.select().where(Favorite.user_id == user_id).order_by(Favorite.id)
+    favorites = serializer.rows(read_session().execute(stmt))
+    if pending:
+        favorites = [favorite for favorite in favorites
+                     if pending.get((favorite["type"], favorite["item_id"])) != REMOVE]
+        committed = {(favorite["type"], favorite["item_id"]) for favorite in favorites}
+        favorites += [
+            dict(id=None, type=type, user_id=user_id, item_id=item_id, created_at=None, updated_at=None, pending=True)
+            for (type, item_id), operation in pending.items()
+            if operation == ADD and (type, item_id) not in committed
+        ]
+    return load_favorite_items(favorites)
+
+
+def top_favorites(type, limit):
+    """The `limit` most favorited items of `type`, read from the favorite_count index."""
+    stmt = (
+        select(FavoriteCount.item_id, FavoriteCount.count)
+        .where(FavoriteCount.type == type, FavoriteCount.count > 0)
+        .order_by(FavoriteCount.count.desc(), FavoriteCount.item_id.desc())
+        .limit(limit)
+    )
+    ranking = [dict(type=type, item_id=item_id, count=count) for item_id, count in read_session().execute(stmt)]
+    return load_favorite_items(ranking)
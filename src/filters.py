@@ -0,0 +1,83 @@
+"""
+Declarative filters for the collection endpoints.
+
+The whitelist is derived from each model's serialized columns:
+
+    ?eye_color=blue               equality, on any column
+    ?home_planet_id__in=1,2       membership, on any column
+    ?population__gte=1000         gt/gte/lt/lte, on numeric and timestamp columns
+    ?q=sky                        name search on people and planets (see search.py)
+
+Parameters starting with `_` (cache busters) are ignored.
+"""
+from datetime import datetime
+from functools import lru_cache
+from utils import APIException, parse_timestamp
+from serializers import serializer_for
+from pagination import bind_value
+from search import apply_search
+
+# query parameters that are not column filters
+RESERVED_PARAMS = {"limit", "cursor", "sort", "fields", "stream", "since", "q", "chunk_size", "ids", "include"}
+
+RANGE_OPERATORS = {
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+}
+
+
+@lru_cache(maxsize=None)
+def filterable_columns(model):
+    """`{name: (column, allowed operators)}` for every serialized column of `model`."""
+    serializer = serializer_for(model)
+    columns = {}
+    for key, column in zip(serializer.keys, serializer.columns):
+        operators = {"eq", "in"}
+        if column.type.python_type in (int, float, datetime):
+            operators.update(RANGE_OPERATORS)
+        columns[key] = (column, operators)
+    return columns
+
+
+def _coerce(key, column, raw):
+    python_type = column.type.python_type
+    try:
+        if python_type is bool:
+            if raw.lower() not in ("true", "false", "1", "0"):
+                raise ValueError(raw)
+            return raw.lower() in ("true", "1")
+        if python_type is datetime:
+            return bind_value(parse_timestamp(raw))
+        return python_type(raw)
+    except ValueError:
+        raise APIException(f"Invalid value for {key}: {raw}", status_code=400)
+
+
+def filtered(model, stmt, args):
+    """Add the WHERE clauses requested in `args` to `stmt`."""
+    columns = filterable_columns(model)
+
+    for key in args:
+        if key in RESERVED_PARAMS or key.startswith("_"):
+            continue
+        name, _, operator = key.partition("__")
+        operator = operator or "eq"
+        if name not in columns:
+            raise APIException(f"Unknown filter {key}. Filterable: {', '.join(columns)}", status_code=400)
+        column, operators = columns[name]
+        if operator not in operators:
+            raise APIException(f"{name} supports: {', '.join(sorted(operators))}", status_code=400)
+
+        for raw in args.getlist(key):
+            if operator == "eq":
+                stmt = stmt.where(column == _coerce(key, column, raw))
+            elif operator == "in":
+                stmt = stmt.where(column.in_([_coerce(key, column, value) for value in raw.split(",")]))
+            else:
+                stmt = stmt.where(RANGE_OPERATORS[operator](column, _coerce(key, column, raw)))
+
+    if args.get("q"):
+        stmt = apply_search(model, stmt, args["q"])
+    return stmt
@@ -0,0 +1,87 @@
+"""
+Embedded relationship expansion (`?include=`) for the collection endpoints.
+
+`/people?include=home_planet` and `/planet?include=residents` embed the
+related rows in every item. Like `selectinload`, each include costs one
+`WHERE key IN (...)` query for the whole page, never one query per item.
+
+Such pages hold rows of two tables: their ETag also covers the included
+table (see conditional.py) and a write to either resource clears both
+response cache namespaces.
+"""
+from collections import defaultdict
+from sqlalchemy.orm import MANYTOONE
+from utils import APIException
+from models import People, Planet
+from replicas import read_session
+from serializers import serializer_for
+from cache import response_cache
+
+INCLUDES = {
+    People: {"home_planet": People.home_planet},
+    Planet: {"residents": Planet.residents},
+}
+
+
+def related_models(includes):
+    """The models whose rows the `includes` embed."""
+    return [relationship.property.mapper.class_ for relationship in includes.values()]
+
+
+for model, relationships in INCLUDES.items():
+    for related in related_models(relationships):
+        response_cache.depend(model.__tablename__, on=related.__tablename__)
+
+
+def parse_includes(model, args):
+    """Return the `{name: relationship}` requested with `?include=a,b`."""
+    raw = args.get("include")
+    if not raw:
+        return {}
+    available = INCLUDES.get(model, {})
+    names = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise APIException(
+            f"Unknown include: {', '.join(unknown)}. Available: {', '.join(available) or 'none'}",
+            status_code=400
+        )
+    return {name: available[name] for name in names}
+
+
+def _join_keys(relationship):
+    """The `(local key, remote column)` pair the relationship joins on."""
+    local, remote = relationship.property.local_remote_pairs[0]
+    return local.key, getattr(relationship.property.mapper.class_, remote.key)
+
+
+def include_fields(fields, includes):
+    """Make sure a sparse `?fields=` list still selects the keys the includes join on."""
+    if not fields or not includes:
+        return fields
+    keys = [_join_keys(relationship)[0] for relationship in includes.values()]
+    return ",".join([fields] + keys)
+
+
+def embed(items, includes):
+    """Add the related rows of every include to the serialized `items`."""
+    for name, relationship in includes.items():
+        local_key, remote = _join_keys(relationship)
+        serializer = serializer_for(relationship.property.mapper.class_)
+        ids = {item[local_key] for item in items if item[local_key] is not None}
+
+        related = []
+        if ids:
+            related = serializer.rows(read_session().execute(serializer.select().where(remote.in_(ids))))
+
+        if relationship.property.direction is MANYTOONE:
+            by_key = {row[remote.key]: row for row in related}
+            for item in items:
+                item[name] = by_key.get(item[local_key])
+        else:
+            by_key = defaultdict(list)
+            for row in related:
+                by_key[row[remote.key]].append(row)
+            for item in items:
+                item[name] = by_key.get(item[local_key], [])
+    return items
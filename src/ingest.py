@@ -0,0 +1,348 @@
+"""
+Bulk ingestion of SWAPI style dumps: `flask ingest`.
+
+    flask ingest --planets planets.json --people people.json --favorites favorites.csv
+
+Files are read as streams, so memory stays flat whatever their size: JSON
+arrays (including SWAPI's `{"results": [...]}` pages and Django fixtures),
+NDJSON (.ndjson / .jsonl) or CSV with a header row. Rows are written in
+batches of --batch-size, with COPY on Postgres and one executemany INSERT
+on other databases. Duplicate favorites are skipped, the inserted ones are
+added to the favorite counts in the same transaction.
+
+People find their planet through `home_planet_id`, or through `homeworld` /
+`home_planet` holding a planet name, a SWAPI planet URL or the fixture pk of
+a planet loaded in the same run. Names resolve through an in memory map of
+the planet table.
+
+Every batch commits together with an ingest_checkpoint row counting the
+records consumed. Run the command again with the same files and an
+interrupted ingest carries on after the last committed batch. --restart
+ignores the checkpoints. Running servers see the new rows once their
+response caches expire.
+"""
+import io
+import os
+import re
+import csv
+import json
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert
+from models import db, People, Planet, Favorite, IngestCheckpoint, FAVORITE_MODELS
+from bulk import insert_ignoring_conflicts
+import favorite_counts
+from versions import touch
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 5000))
+JSON_CHUNK_SIZE = 1 << 16
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+#region Readers
+def _read_json(file):
+    """Yield the records of a JSON array (or the `results` array of an object) as they are parsed."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = file.read(JSON_CHUNK_SIZE)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+    def find(token):
+        nonlocal position
+        while (index := buffer.find(token, position)) < 0:
+            if eof:
+                raise click.ClickException(f"{file.name}: expected a JSON array of records")
+            fill()
+        position = index + len(token)
+
+    fill()
+    while not buffer.strip() and not eof:
+        fill()
+    if buffer.lstrip().startswith("{"):
+        find('"results"')
+    find("[")
+
+    while True:
+        position = _SEPARATORS.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                raise click.ClickException(f"{file.name}: unterminated JSON array")
+            fill()
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # a record split across chunks, or a broken file once nothing is left to read
+            if eof:
+                raise click.ClickException(f"{file.name}: invalid JSON near character {position}")
+            fill()
+            continue
+        yield record
+
+
+def _read_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _read_csv(file):
+    for record in csv.DictReader(file):
+        yield {key: value for key, value in record.items() if value not in ("", None)}
+
+
+def read_records(path):
+    readers = {".csv": _read_csv, ".ndjson": _read_ndjson, ".jsonl": _read_ndjson}
+    reader = readers.get(os.path.splitext(path)[1].lower(), _read_json)
+    with open(path, newline="", encoding="utf-8") as file:
+        yield from reader(file)
+#endregion Readers
+
+
+#region Mapping
+def _value(record, *keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, "", "n/a"):
+            return value
+    return None
+
+
+def _int(value, default=None):
+    try:
+        return int(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return default
+
+
+def _planet_key(value):
+    """SWAPI planet URLs compare by path, so swapi.co and swapi.dev dumps agree."""
+    value = str(value)
+    if value.startswith(("http://", "https://")):
+        return urlsplit(value).path.rstrip("/")
+    return value
+
+
+class PlanetResolver:
+    """Maps the planet references found in people records to planet ids."""
+
+    def __init__(self):
+        self.ids = None
+        self.names = {}
+
+    def remember(self, record, name):
+        for key in ("url", "pk"):
+            if record.get(key) is not None:
+                self.names[_planet_key(record[key])] = name
+
+    def reload(self):
+        self.ids = None
+
+    def resolve(self, record):
+        if _value(record, "home_planet_id") is not None:
+            return _int(record["home_planet_id"])
+        reference = _value(record, "homeworld", "home_planet")
+        if reference is None:
+            return None
+        if self.ids is None:
+            self.ids = dict(db.session.execute(select(Planet.name, Planet.id)).all())
+        key = _planet_key(reference)
+        return self.ids.get(self.names.get(key, key))
+
+
+def _fields(record):
+    # Django fixtures nest the columns: {"model": ..., "pk": 1, "fields": {...}}
+    if isinstance(record.get("fields"), dict):
+        return dict(record["fields"], pk=record.get("pk"))
+    return record
+
+
+def planet_row(record, resolver):
+    name = _value(record, "name")
+    if name is None:
+        return None
+    resolver.remember(record, name)
+    return {
+        "name": name,
+        "climate": _value(record, "climate") or "unknown",
+        "population": _int(_value(record, "population"), 0),
+    }
+
+
+def people_row(record, resolver):
+    name = _value(record, "name")
+    if name is None:
+        return None
+    return {
+        "name": name,
+        "age": str(_value(record, "age", "birth_year") or "unknown"),
+        "eye_color": _value(record, "eye_color") or "unknown",
+        "home_planet_id": resolver.resolve(record),
+    }
+
+
+def favorite_row(record, resolver):
+    row = {
+        "user_id": _int(_value(record, "user_id")),
+        "type": _value(record, "type"),
+        "item_id": _int(_value(record, "item_id")),
+    }
+    if None in row.values() or row["type"] not in FAVORITE_MODELS:
+        return None
+    return row
+
+
+RESOURCES = {
+    "planet": (Planet, planet_row),
+    "people": (People, people_row),
+    "favorite": (Favorite, favorite_row),
+}
+#endregion Mapping
+
+
+#region Writers
+def _copy(model, rows, skip_duplicates):
+    """
+    COPY `rows` into `model`'s table on the session's connection, so it shares
+    the transaction. With skip_duplicates the `(type, item_id)` of the rows
+    inserted are returned.
+    """
+    preparer = db.engine.dialect.identifier_preparer
+    table = preparer.format_table(model.__table__)
+    keys = list(rows[0]) + ["created_at", "updated_at"]
+    columns = ", ".join(preparer.quote(key) for key in keys)
+
+    # COPY bypasses the ORM column defaults
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(list(row.values()) + [now, now])
+    buffer.seek(0)
+
+    # COPY runs on the raw cursor, out of sight of the session events
+    touch(model.__tablename__)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        if not skip_duplicates:
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            return
+        staging = preparer.quote(f"ingest_{model.__tablename__}")
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS "
+                       f"AS SELECT {columns} FROM {table} WITH NO DATA")
+        cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+                       f"ON CONFLICT DO NOTHING RETURNING type, item_id")
+        inserted = cursor.fetchall()
+        cursor.execute(f"TRUNCATE {staging}")
+        return inserted
+    finally:
+        cursor.close()
+
+
+def write_batch(model, rows):
+    """Insert `rows`, returns how many were written (duplicate favorites are not)."""
+    skip_duplicates = model is Favorite
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        inserted = _copy(model, rows, skip_duplicates)
+    elif skip_duplicates:
+        stmt = insert_ignoring_conflicts(model).returning(Favorite.type, Favorite.item_id)
+        inserted = db.session.execute(stmt, rows).all()
+    else:
+        db.session.execute(insert(model), rows)
+    if not skip_duplicates:
+        return len(rows)
+    favorite_counts.added(inserted)
+    return len(inserted)
+#endregion Writers
+
+
+def _checkpoint(resource, path, restart):
+    source = f"{resource}:{os.path.abspath(path)}"
+    stat = os.stat(path)
+    fingerprint = f"{stat.st_size}:{int(stat.st_mtime)}"
+    checkpoint = db.session.execute(
+        select(IngestCheckpoint).where(IngestCheckpoint.source == source)
+    ).scalar_one_or_none()
+    if checkpoint is None:
+        checkpoint = IngestCheckpoint(source=source, fingerprint=fingerprint, rows=0)
+        db.session.add(checkpoint)
+    elif restart:
+        checkpoint.fingerprint, checkpoint.rows = fingerprint, 0
+    elif checkpoint.fingerprint != fingerprint:
+        raise click.ClickException(f"{path} changed since its last ingest, pass --restart to load it again")
+    return checkpoint
+
+
+def ingest_file(resource, path, batch_size, restart, resolver):
+    model, to_row = RESOURCES[resource]
+    checkpoint = _checkpoint(resource, path, restart)
+    resume_at = checkpoint.rows
+    if resume_at:
+        click.echo(f"{resource}: resuming {path} after record {resume_at}")
+
+    consumed = written = skipped = duplicates = 0
+    batch = []
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal written, duplicates, batch
+        if batch:
+            inserted = write_batch(model, batch)
+            written += inserted
+            duplicates += len(batch) - inserted
+        checkpoint.rows = consumed
+        db.session.commit()
+        batch = []
+        rate = written / (time.perf_counter() - start)
+        click.echo(f"{resource}: {written} rows written, {consumed} records read, {rate:,.0f} rows/s")
+
+    for record in read_records(path):
+        consumed += 1
+        # skipped planets still have to be mapped for the people that reference them
+        row = to_row(_fields(record), resolver)
+        if consumed <= resume_at:
+            continue
+        if row is None:
+            skipped += 1
+        else:
+            batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if consumed <= resume_at:
+        click.echo(f"{resource}: {path} is already ingested")
+        return
+    flush()
+
+    elapsed = time.perf_counter() - start
+    click.echo(f"{resource}: done, {written} rows in {elapsed:.1f}s ({written / elapsed if elapsed else 0:,.0f} rows/s)"
+               + (f", {skipped} invalid records skipped" if skipped else "")
+               + (f", {duplicates} duplicates skipped" if duplicates else ""))
+
+
+@click.command("ingest")
+@click.option("--planets", type=click.Path(exists=True, dir_okay=False), help="Planet records to load first.")
+@click.option("--people", type=click.Path(exists=True, dir_okay=False), help="People records.")
+@click.option("--favorites", type=click.Path(exists=True, dir_okay=False), help="Favorite records.")
+@click.option("--batch-size", default=INGEST_BATCH_SIZE, show_default=True, help="Rows per INSERT / COPY and commit.")
+@click.option("--restart", is_flag=True, help="Ignore checkpoints and load the files from the start.")
+@with_appcontext
+def ingest_command(planets, people, favorites, batch_size, restart):
+    """Load planets, people and favorites from JSON, NDJSON or CSV files."""
+    if not (planets or people or favorites):
+        raise click.UsageError("Pass at least one of --planets, --people or --favorites")
+    resolver = PlanetResolver()
+    for resource, path in (("planet", planets), ("people", people), ("favorite", favorites)):
+        if path:
+            ingest_file(resource, path, batch_size, restart, resolver)
+            resolver.reload()
@@ -0,0 +1,170 @@
+"""
+Prometheus metrics, served by `GET /metrics`.
+
+Every request to a route registered on the app (and every 404) is counted by
+method, route rule and status, timed into a latency histogram and tracked
+while in flight. The routes asgi.py serves natively record the same series
+through start_request() / finish_request(), labelled with the Flask rule. Pool usage of the primary and replica engines and the
+response/object cache counters are copied into gauges and counters at most
+once per METRICS_SYNC_INTERVAL seconds per process, so the hot path only
+pays for the request metrics themselves.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py at the repo
+root does) and every worker writes its samples there, so whichever worker
+answers /metrics reports all of them. Hit ratios across workers are
+`rate(cache_requests_total{result="hit"}[5m]) / rate(cache_requests_total[5m])`,
+`cache_hit_ratio` is the per process ratio since start.
+
+Disabled with METRICS_ENABLED=0 or when prometheus_client is not installed.
+"""
+import os
+import time
+import threading
+from flask import g, request
+from utils import APIException
+from models import db
+from database import pool_stats
+from cache import response_cache, object_cache
+import replicas
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, multiprocess
+except ImportError:
+    prometheus_client = None
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1" and prometheus_client is not None
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", 1))
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+if METRICS_ENABLED:
+    REQUESTS = Counter("http_requests_total", "Requests handled.", ["method", "endpoint", "status"])
+    LATENCY = Histogram("http_request_duration_seconds", "Time to produce the response headers.",
+                        ["method", "endpoint"], buckets=LATENCY_BUCKETS)
+    IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled.", ["method", "endpoint"],
+                      multiprocess_mode="livesum")
+
+    POOL_SIZE = Gauge("db_pool_size", "Connections the pool keeps open.", ["pool"], multiprocess_mode="livesum")
+    POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections in use.", ["pool"], multiprocess_mode="livesum")
+    POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections opened past the pool size.", ["pool"],
+                          multiprocess_mode="livesum")
+    POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connection checkouts.", ["pool"])
+    POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that timed out.", ["pool"])
+    POOL_WAIT = Counter("db_pool_wait_seconds_total", "Time spent waiting for a connection.", ["pool"])
+
+    CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups.", ["cache", "result"])
+    CACHE_HIT_RATIO = Gauge("cache_hit_ratio", "Hits over lookups of this process since start.", ["cache"],
+                            multiprocess_mode="liveall")
+    CACHE_SIZE = Gauge("cache_entries", "Entries held in the cache.", ["cache"], multiprocess_mode="livesum")
+
+
+class ProcessMetrics:
+    """Copies the pool and cache statistics of this process into the registry."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+        self._totals = {}
+
+    def _inc_to(self, counter, labels, total):
+        # the sources keep running totals, counters only take increments
+        key = (counter, labels)
+        delta = total - self._totals.get(key, 0)
+        # labels() alone already exports the series at 0
+        child = counter.labels(*labels)
+        if delta > 0:
+            child.inc(delta)
+        self._totals[key] = total
+
+    def _sync_pool(self, name, stats):
+        for gauge, key in ((POOL_SIZE, "size"), (POOL_CHECKED_OUT, "checked_out"), (POOL_OVERFLOW, "overflow")):
+            if key in stats:
+                gauge.labels(name).set(stats[key])
+        if "checkouts" in stats:
+            self._inc_to(POOL_CHECKOUTS, (name,), stats["checkouts"])
+            self._inc_to(POOL_TIMEOUTS, (name,), stats["timeouts"])
+            self._inc_to(POOL_WAIT, (name,), stats["wait_total_ms"] / 1000)
+
+    def _sync_cache(self, name, stats):
+        lookups = 0
+        for key, result in (("hits", "hit"), ("negative_hits", "negative_hit"), ("misses", "miss")):
+            if key in stats:
+                self._inc_to(CACHE_REQUESTS, (name, result), stats[key])
+                lookups += stats[key]
+        CACHE_HIT_RATIO.labels(name).set((stats["hits"] + stats.get("negative_hits", 0)) / lookups if lookups else 0)
+        CACHE_SIZE.labels(name).set(stats["size"])
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._synced_at < METRICS_SYNC_INTERVAL:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._synced_at = now
+            self._sync_pool("primary", pool_stats(db.engine))
+            for replica in replicas.router.stats():
+                self._sync_pool(replica["url"], replica)
+            self._sync_cache("responses", response_cache.stats())
+            self._sync_cache("objects", object_cache.stats())
+        finally:
+            self._lock.release()
+
+
+process_metrics = ProcessMetrics()
+
+
+def _labels():
+    return request.method, request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def start_request(method, endpoint):
+    """Count a request as in flight, returns what finish_request() takes."""
+    labels = (method, endpoint)
+    IN_FLIGHT.labels(*labels).inc()
+    return labels, time.perf_counter()
+
+
+def finish_request(started, status):
+    labels, start = started
+    LATENCY.labels(*labels).observe(time.perf_counter() - start)
+    REQUESTS.labels(*labels, str(status)).inc()
+    IN_FLIGHT.labels(*labels).dec()
+
+
+def render():
+    """The exposition text and its content type."""
+    if not METRICS_ENABLED:
+        raise APIException("Metrics are disabled", status_code=404)
+    process_metrics.sync(force=True)
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = start_request(*_labels())
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            finish_request(started, response.status_code)
+        process_metrics.sync()
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception=None):
+        # after_request is skipped when the request failed before producing a response
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            finish_request(started, 500)
@@ -1,7 +1,7 @@
 import os
 import sys
-from sqlalchemy.orm import declarative_base, Mapped, mapped_column
-from sqlalchemy import create_engine, String, Boolean, ForeignKey, DateTime, func
+from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship
+from sqlalchemy import create_engine, String, Boolean, ForeignKey, DateTime, func, Index, UniqueConstraint
 from flask_sqlalchemy import SQLAlchemy
 
 # Base = declarative_base()
@@ -10,6 +10,9 @@ db = SQLAlchemy()
 
 class User(db.Model):
     __tablename__ = "user"
+    __table_args__ = (
+        Index("ix_user_updated_at_id", "updated_at", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     email: Mapped[str] = mapped_column(unique=True, nullable=False)
@@ -30,6 +33,12 @@ class User(db.Model):
 
 class Favorite(db.Model):
     __tablename__ = "favorite"
+    __table_args__ = (
+        # one favorite per user and item, also serves the `user_id = ?` lookups
+        UniqueConstraint("user_id", "type", "item_id", name="uq_favorite_user_id_type_item_id"),
+        Index("ix_favorite_type_item_id", "type", "item_id"),
+        Index("ix_favorite_updated_at_id", "updated_at", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     type: Mapped[str] = mapped_column(nullable=False)
@@ -50,6 +59,12 @@ class Favorite(db.Model):
 
 class Planet(db.Model):
     __tablename__ = "planet"
+    __table_args__ = (
+        Index("ix_planet_updated_at_id", "updated_at", "id"),
+        Index("ix_planet_name_id", "name", "id"),
+        Index("ix_planet_population_id", "population", "id"),
+        # on Postgres ?q= is also served by the pg_trgm index ix_planet_name_trgm (migration 5b8f0e3a7c21)
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(nullable=False)
@@ -58,6 +73,8 @@ class Planet(db.Model):
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), nullable=False)
     updated_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
 
+    residents: Mapped[list["People"]] = relationship(back_populates="home_planet")
+
     def serialize(self):
         return {
             "id": self.id,
@@ -70,15 +87,23 @@ class Planet(db.Model):
 
 class People(db.Model):
     __tablename__ = "people"
+    __table_args__ = (
+        Index("ix_people_updated_at_id", "updated_at", "id"),
+        Index("ix_people_name_id", "name", "id"),
+        Index("ix_people_eye_color_id", "eye_color", "id"),
+        # on Postgres ?q= is also served by the pg_trgm index ix_people_name_trgm (migration 5b8f0e3a7c21)
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(nullable=False)
     age: Mapped[str] = mapped_column(nullable=False)
     eye_color: Mapped[str] = mapped_column(nullable=False)
-    home_planet_id: Mapped[int] = mapped_column(ForeignKey("planet.id"), nullable=True)
+    home_planet_id: Mapped[int] = mapped_column(ForeignKey("planet.id"), nullable=True, index=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), nullable=False)
     updated_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
 
+    home_planet: Mapped["Planet"] = relationship(back_populates="residents")
+
     def serialize(self):
         return {
             "id": self.id,
@@ -90,3 +115,59 @@ class People(db.Model):
             "updated_at": self.updated_at,
             # do not serialize the password, its a security breach
         }
+
+class Tombstone(db.Model):
+    __tablename__ = "tombstone"
+    __table_args__ = (
+        Index("ix_tombstone_resource_deleted_at", "resource", "deleted_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    resource: Mapped[str] = mapped_column(nullable=False)
+    item_id: Mapped[int] = mapped_column(nullable=False)
+    deleted_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), nullable=False)
+
+    def serialize(self):
+        return {
+            "id": self.item_id,
+            "deleted_at": self.deleted_at
+        }
+
+# how many records of a source file `flask ingest` has committed (see ingest.py)
+class IngestCheckpoint(db.Model):
+    __tablename__ = "ingest_checkpoint"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    source: Mapped[str] = mapped_column(unique=True, nullable=False)
+    fingerprint: Mapped[str] = mapped_column(nullable=False)
+    rows: Mapped[int] = mapped_column(nullable=False)
+    updated_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+# how many favorites point at each item, kept in step by every favorite write (see favorite_counts.py)
+class FavoriteCount(db.Model):
+    __tablename__ = "favorite_count"
+    __table_args__ = (
+        UniqueConstraint("type", "item_id", name="uq_favorite_count_type_item_id"),
+        # GET /favorites/top reads `WHERE type = ? ORDER BY count DESC` straight off this index
+        Index("ix_favorite_count_type_count_item_id", "type", "count", "item_id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    type: Mapped[str] = mapped_column(nullable=False)
+    item_id: Mapped[int] = mapped_column(nullable=False)
+    count: Mapped[int] = mapped_column(nullable=False)
+    updated_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+# bumped once by every transaction that writes to `resource`, for the ETags (see versions.py)
+class TableVersion(db.Model):
+    __tablename__ = "table_version"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    resource: Mapped[str] = mapped_column(unique=True, nullable=False)
+    version: Mapped[int] = mapped_column(nullable=False)
+
+# Favorite.type values and the model each one points at
+FAVORITE_MODELS = {
+    "people": People,
+    "planet": Planet,
+}
@@ -0,0 +1,166 @@
+"""
+Keyset (cursor) pagination shared by the collection endpoints.
+
+Instead of loading a whole table, every page is an indexed range scan:
+``WHERE (sort_key, id) > (last_sort_key, last_id) ORDER BY sort_key, id LIMIT n``
+(``<`` and ``DESC`` for ``?sort=-sort_key``).
+The position of the last row is handed back to the client as an opaque
+``next_cursor`` token that it passes as ``?cursor=`` to get the next page.
+"""
+import os
+import json
+import base64
+import binascii
+from functools import lru_cache
+from datetime import datetime
+from sqlalchemy import and_, or_, type_coerce, String, UniqueConstraint
+from utils import APIException
+from models import db
+from serializers import serializer_for
+from replicas import read_session
+
+DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", 100))
+MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", 1000))
+
+
+def parse_limit(args):
+    raw = args.get("limit")
+    if raw is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    return min(limit, MAX_LIMIT)
+
+
+@lru_cache(maxsize=None)
+def sortable_keys(model):
+    """
+    Columns a collection can be walked by: the non-nullable, serialized columns
+    that lead an index or unique constraint. `id` is always the tie breaker.
+    """
+    table = model.__table__
+    leading = {column.key for column in table.primary_key.columns}
+    leading.update(index.columns[0].key for index in table.indexes)
+    leading.update(constraint.columns[0].key for constraint in table.constraints
+                   if isinstance(constraint, UniqueConstraint))
+    serialized = serializer_for(model).keys
+    return tuple(column.key for column in table.columns
+                 if column.key in leading and column.key in serialized and not column.nullable)
+
+
+def parse_sort(model, args, default="id"):
+    sort = args.get("sort", default)
+    if sort.lstrip("-") not in sortable_keys(model):
+        keys = ", ".join(sortable_keys(model))
+        raise APIException(f"sort must be one of: {keys} (prefix with - for descending)", status_code=400)
+    return sort
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _load_value(column, value):
+    if value is not None and column.type.python_type is datetime:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def encode_cursor(sort, values):
+    payload = {"s": sort, "v": [_dump_value(value) for value in values]}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, sort, columns):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        values = payload["v"]
+        if payload["s"] != sort or len(values) != len(columns):
+            raise ValueError(token)
+        return [_load_value(column, value) for column, value in zip(columns, values)]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise APIException("Invalid cursor", status_code=400)
+
+
+def bind_value(value):
+    """
+    SQLite stores `func.now()` defaults as 'YYYY-MM-DD HH:MM:SS' text, while a bound
+    datetime is rendered with microseconds, so equal timestamps would not compare
+    equal. Bind datetimes in the server format there.
+    """
+    if isinstance(value, datetime) and db.engine.dialect.name == "sqlite":
+        timespec = "microseconds" if value.microsecond else "seconds"
+        return type_coerce(value.isoformat(sep=" ", timespec=timespec), String)
+    return value
+
+
+def sort_columns(model, sort):
+    """Return the `(columns, descending)` a sort spec such as `-name` orders by."""
+    key = sort.lstrip("-")
+    columns = [model.id] if key == "id" else [getattr(model, key), model.id]
+    return columns, sort.startswith("-")
+
+
+def after_cursor(columns, values, descending=False):
+    """Build the `(a, b) > (x, y)` keyset predicate without relying on row value support."""
+    column, value = columns[0], bind_value(values[0])
+    beyond = column < value if descending else column > value
+    if len(columns) == 1:
+        return beyond
+    return or_(beyond, and_(column == value, after_cursor(columns[1:], values[1:], descending)))
+
+
+def page_statement(model, args, stmt=None, default_sort="id"):
+    """
+    Build the keyset page query, returns `(stmt, finish)` where `finish(rows)`
+    trims the fetched rows to `(rows, next_cursor)`. Split from paginate() so
+    the async entry point can run the same query on its own session.
+
+    `stmt` may be a pre-filtered select of the model's serializer columns; the
+    keyset predicate, ordering and limit are added here. `next_cursor` is None
+    on the last page. Sort columns missing from a sparse fieldset are selected
+    after the requested ones, where the serializer ignores them.
+    """
+    limit = parse_limit(args)
+    sort = parse_sort(model, args, default_sort)
+    columns, descending = sort_columns(model, sort)
+
+    if stmt is None:
+        stmt = serializer_for(model).select()
+
+    selected = set(stmt.selected_columns.keys())
+    missing = [column for column in columns if column.key not in selected]
+    if missing:
+        stmt = stmt.add_columns(*missing)
+
+    cursor = args.get("cursor")
+    if cursor:
+        stmt = stmt.where(after_cursor(columns, decode_cursor(cursor, sort, columns), descending))
+
+    # fetch one extra row to find out if there is a next page
+    order = [column.desc() for column in columns] if descending else columns
+    stmt = stmt.order_by(*order).limit(limit + 1)
+
+    def finish(rows):
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, [getattr(last, column.key) for column in columns])
+        return rows, next_cursor
+
+    return stmt, finish
+
+
+def paginate(model, args, stmt=None, default_sort="id"):
+    """Return one page of `model` rows as `(rows, next_cursor)`, see page_statement()."""
+    stmt, finish = page_statement(model, args, stmt, default_sort)
+    return finish(read_session().execute(stmt).all())
@@ -0,0 +1,207 @@
+"""
+Opt-in per request profiling.
+
+PROFILING=1 profiles every request, PROFILING=header only the ones sent
+with `X-Profile: 1`. A profiled request records its wall time, the number
+of SQL statements and the time spent in them (cursor events on every
+engine, replicas included), the time spent encoding JSON and the response
+size. They are sent back as a `Server-Timing` header and logged as one JSON
+line on the `profiling` logger.
+
+PROFILING_SAMPLE_RATE=0.05 additionally runs that fraction of the profiled
+requests under cProfile (or pyinstrument with PROFILING_ENGINE=pyinstrument)
+and keeps the PROFILING_KEEP slowest of them in PROFILING_DIR, as .prof
+files for `python -m pstats` / snakeviz, or .html for pyinstrument.
+
+Streamed responses are timed up to their headers, the ASGI native routes
+are not profiled.
+"""
+import os
+import json
+import time
+import heapq
+import random
+import logging
+import cProfile
+import threading
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+PROFILING = os.getenv("PROFILING", "0").lower()
+PROFILING_HEADER = "X-Profile"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_ENGINE = os.getenv("PROFILING_ENGINE", "cprofile").lower()
+PROFILING_DIR = os.getenv("PROFILING_DIR", "/tmp/starwars-profiles")
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", 20))
+
+logger = logging.getLogger("profiling")
+
+
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.profiler = None
+
+    def server_timing(self, wall):
+        return ", ".join((
+            f"app;dur={wall * 1000:.2f}",
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f"serialize;dur={self.serialize_time * 1000:.2f}",
+        ))
+
+
+class SlowestProfiles:
+    """Keeps the `keep` slowest sampled profiles on disk, dropping faster ones."""
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self._heap = []
+        self._lock = threading.Lock()
+        # only one sampling profiler may be active per process
+        self.profiler_lock = threading.Lock()
+
+    def start(self):
+        if not self.profiler_lock.acquire(blocking=False):
+            return None
+        if PROFILING_ENGINE == "pyinstrument" and pyinstrument is not None:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop(self, profiler):
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+        self.profiler_lock.release()
+
+    def offer(self, profiler, wall, name):
+        with self._lock:
+            if len(self._heap) >= self.keep and wall <= self._heap[0][0]:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            extension = "prof" if isinstance(profiler, cProfile.Profile) else "html"
+            path = os.path.join(self.directory, f"{wall * 1000:09.1f}ms-{name}-{time.time_ns()}.{extension}")
+            if isinstance(profiler, cProfile.Profile):
+                profiler.dump_stats(path)
+            else:
+                with open(path, "w") as file:
+                    file.write(profiler.output_html())
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, (wall, path))
+                return path
+            _, evicted = heapq.heappushpop(self._heap, (wall, path))
+            if os.path.exists(evicted):
+                os.remove(evicted)
+            return path
+
+
+slowest = SlowestProfiles(PROFILING_DIR, PROFILING_KEEP)
+
+
+def current_profile():
+    if has_request_context():
+        return g.get("profile")
+    return None
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in the block to the `<name>_time` of the current profile."""
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(profile, f"{name}_time", getattr(profile, f"{name}_time") + time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    starts = conn.info.get("profile_start")
+    if profile is not None and starts:
+        profile.queries += 1
+        profile.db_time += time.perf_counter() - starts.pop()
+
+
+def wants_profile():
+    if PROFILING in ("1", "true", "yes"):
+        return True
+    return PROFILING == "header" and request.headers.get(PROFILING_HEADER) == "1"
+
+
+def init_app(app):
+    if PROFILING in ("0", "false", "no", ""):
+        return
+    # the admin app (admin.py) registers its hooks too, the engine wide listeners only once
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+
+    @app.before_request
+    def start_profile():
+        if not wants_profile():
+            return
+        g.profile = RequestProfile()
+        if PROFILING_SAMPLE_RATE and random.random() < PROFILING_SAMPLE_RATE:
+            g.profile.profiler = slowest.start()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        wall = time.perf_counter() - profile.start
+
+        dump = None
+        if profile.profiler is not None:
+            slowest.stop(profile.profiler)
+            dump = slowest.offer(profile.profiler, wall, request.endpoint or "unknown")
+
+        size = None if response.is_streamed else response.calculate_content_length()
+        response.headers["Server-Timing"] = profile.server_timing(wall)
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "wall_ms": round(wall * 1000, 3),
+            "queries": profile.queries,
+            "db_ms": round(profile.db_time * 1000, 3),
+            "serialize_ms": round(profile.serialize_time * 1000, 3),
+            "bytes": size,
+            "profile": dump,
+        }))
+        return response
+
+    @app.teardown_request
+    def release_profiler(exception=None):
+        # after_request does not run when the request failed before producing a response
+        profile = g.pop("profile", None)
+        if profile is not None and profile.profiler is not None:
+            slowest.stop(profile.profiler)
@@ -0,0 +1,192 @@
+"""
+Read replica routing.
+
+Set DATABASE_REPLICA_URLS to a comma separated list of replica URLs and the
+read paths of GET requests run on a replica session, picked round-robin
+among the replicas that passed their last health check. Writes, and reads
+that must see them, stay on the primary `db.session`:
+
+- every successful non-GET request sets a `read_primary_until` cookie, so
+  the same client reads from the primary for REPLICA_RYW_WINDOW seconds
+- `X-Read-Consistency: primary` forces a primary read
+- delta sync (`?since=`) reads the primary, a lagging replica would hand out
+  a server_time later than the primary writes it has not replayed yet
+
+With no replica configured, or none healthy, read_session() is db.session.
+Health checks run in a background thread when a replica is due for one, and
+replica connections time out after REPLICA_CONNECT_TIMEOUT seconds, so a
+dead replica never holds a request. A replica whose connection fails during
+a request is marked unhealthy and the request is served again from the
+primary.
+The native ASGI routes route their reads with the same rules on async
+engines of the same replicas (see asgi.py).
+The in process caches (cache.py) are skipped by requests that read from the
+primary, and are not filled from a replica for REPLICA_RYW_WINDOW seconds
+after this process invalidated the entry, while the replica may still lag.
+"""
+import os
+import time
+import itertools
+import threading
+from flask import g, request, has_request_context, current_app
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError, InterfaceError
+from sqlalchemy.orm import Session
+from models import db
+from database import engine_options, configure_engine, pool_stats
+
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", 10))
+REPLICA_RYW_WINDOW = int(os.getenv("REPLICA_RYW_WINDOW", 5))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", 2))
+RYW_COOKIE = "read_primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+
+class Replica:
+    def __init__(self, url):
+        options = engine_options(url)
+        if url.startswith("postgresql"):
+            options["connect_args"] = dict(options.get("connect_args", {}), connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        self.engine = create_engine(url, **options)
+        configure_engine(self.engine)
+        event.listen(self.engine, "handle_error", self._on_error)
+        self.healthy = True
+        self.checked_at = float("-inf")
+        self._checking = False
+        self._lock = threading.Lock()
+
+    def _on_error(self, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, (OperationalError, InterfaceError)):
+            self.mark_down()
+
+    def mark_down(self):
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+    def check_in_background(self):
+        """Start a check() in its own thread, unless one is running already."""
+        with self._lock:
+            if self._checking:
+                return
+            self._checking = True
+        threading.Thread(target=self._background_check, name="replica-health-check", daemon=True).start()
+
+    def _background_check(self):
+        try:
+            self.check()
+        finally:
+            self._checking = False
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.replicas = []
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def configure(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+
+    def pick(self):
+        """The next healthy replica, starting a health check of the ones due for one."""
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[next(self._next) % len(self.replicas)]
+            if time.monotonic() - replica.checked_at > REPLICA_HEALTH_INTERVAL:
+                replica.check_in_background()
+            if replica.healthy:
+                return replica
+        return None
+
+    def stats(self):
+        return [
+            dict(url=replica.engine.url.render_as_string(hide_password=True),
+                 healthy=replica.healthy, **pool_stats(replica.engine))
+            for replica in self.replicas
+        ]
+
+
+router = ReplicaRouter()
+
+
+def must_read_primary(method, consistency, read_primary_until):
+    """The routing rule, from the method, X-Read-Consistency and the cookie (shared with asgi.py)."""
+    if method not in READ_METHODS:
+        return True
+    if (consistency or "").lower() == "primary":
+        return True
+    try:
+        return float(read_primary_until or 0) > time.time()
+    except ValueError:
+        return False
+
+
+def wants_primary():
+    if "since" in request.args:
+        return True
+    return must_read_primary(request.method, request.headers.get("X-Read-Consistency"),
+                             request.cookies.get(RYW_COOKIE))
+
+
+def primary_required():
+    """Whether replicas are configured and this request has to read from the primary."""
+    return bool(router.replicas) and has_request_context() and wants_primary()
+
+
+def read_from_replica():
+    """Whether this request's reads went to a replica."""
+    if not has_request_context():
+        return False
+    session = g.get("read_session")
+    return session is not None and session is not db.session
+
+
+def read_session():
+    """The session read-only helpers should query with in this request."""
+    if not router.replicas or not has_request_context() or wants_primary():
+        return db.session
+    if "read_session" not in g:
+        replica = router.pick()
+        g.read_session = Session(bind=replica.engine) if replica else db.session
+        g.read_replica = replica
+    return g.read_session
+
+
+def init_app(app):
+    router.configure([url.strip().replace("postgres://", "postgresql://")
+                      for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()])
+
+    @app.after_request
+    def remember_write(response):
+        if router.replicas and request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(RYW_COOKIE, str(time.time() + REPLICA_RYW_WINDOW),
+                                max_age=REPLICA_RYW_WINDOW, httponly=True, samesite="Lax")
+        return response
+
+    @app.errorhandler(OperationalError)
+    @app.errorhandler(InterfaceError)
+    def read_from_primary_instead(error):
+        # _on_error() marked the replica down if the error came from its connection
+        replica = g.pop("read_replica", None)
+        if replica is None or replica.healthy:
+            raise error
+        g.pop("read_session").close()
+        g.read_session = db.session
+        # only GET and HEAD read from replicas, serving them again is safe
+        return current_app.dispatch_request()
+
+    @app.teardown_appcontext
+    def close_read_session(exception=None):
+        session = g.pop("read_session", None)
+        if session is not None and session is not db.session:
+            session.close()
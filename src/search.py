@@ -0,0 +1,81 @@
+"""
+Name search (`?q=`) for /people and /planet.
+
+On Postgres this is a case-insensitive substring match served by the pg_trgm
+GIN indexes on `name`. SQLite has no such index, so every worker keeps a
+sorted `(lower(name), id)` list per model that answers prefix searches with
+bisect, and the matching ids are fetched with `id IN (...)`. The list is
+rebuilt after a write to the resource or after SEARCH_INDEX_TTL seconds.
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+from sqlalchemy import select, func
+from utils import APIException
+from models import db, People, Planet
+from cache import response_cache
+from replicas import read_session
+
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", 60))
+# above this many prefix matches the id list is replaced by a LIKE
+SEARCH_MAX_IDS = int(os.getenv("SEARCH_MAX_IDS", 5000))
+
+
+class PrefixIndex:
+    def __init__(self, model):
+        self.model = model
+        self._names = []
+        self._ids = []
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._built_at = None
+
+    def _build(self):
+        rows = read_session().execute(select(func.lower(self.model.name), self.model.id)).all()
+        rows.sort()
+        self._names = [name for name, _ in rows]
+        self._ids = [id for _, id in rows]
+        self._built_at = time.monotonic()
+
+    def search(self, prefix):
+        """Ids whose lowercased name starts with `prefix`, None if there are too many."""
+        with self._lock:
+            if self._built_at is None or time.monotonic() - self._built_at > SEARCH_INDEX_TTL:
+                self._build()
+            start = bisect_left(self._names, prefix)
+            end = bisect_left(self._names, prefix + "\U0010ffff", start)
+            if end - start > SEARCH_MAX_IDS:
+                return None
+            return self._ids[start:end]
+
+
+PREFIX_INDEXES = {
+    People: PrefixIndex(People),
+    Planet: PrefixIndex(Planet),
+}
+response_cache.subscribe("people", PREFIX_INDEXES[People].invalidate)
+response_cache.subscribe("planet", PREFIX_INDEXES[Planet].invalidate)
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def apply_search(model, stmt, q):
+    if model not in PREFIX_INDEXES:
+        raise APIException(f"{model.__tablename__} does not support q", status_code=400)
+
+    q = q.strip().lower()
+    if not q:
+        return stmt
+
+    if db.engine.dialect.name == "postgresql":
+        return stmt.where(model.name.ilike(f"%{_escape_like(q)}%", escape="\\"))
+
+    ids = PREFIX_INDEXES[model].search(q)
+    if ids is None:
+        return stmt.where(func.lower(model.name).like(f"{_escape_like(q)}%", escape="\\"))
+    return stmt.where(model.id.in_(ids))
@@ -0,0 +1,157 @@
+"""
+Schema driven serialization for the read endpoints.
+
+A ModelSerializer is compiled once per model: it knows the column list to
+`select()` and turns the returned row tuples straight into dicts, so list
+endpoints never build ORM instances. The output has the same keys and values
+as the models' serialize() methods.
+
+JSON is encoded with orjson when it is installed. Set JSON_COMPAT=1 to go
+through Flask's jsonify instead, which is byte for byte what the API sent
+before (orjson writes non-ASCII characters as UTF-8 instead of \\u escapes).
+
+Clients that prefer `Accept: application/msgpack` get the same payload as
+MessagePack from json_response(), when msgpack is installed.
+"""
+import os
+from functools import lru_cache
+from datetime import date
+from decimal import Decimal
+from flask import current_app, jsonify, request, has_request_context
+from sqlalchemy import select
+from werkzeug.http import http_date
+from utils import APIException
+from profiling import timer
+from models import User, People, Planet, Favorite
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_COMPAT = os.getenv("JSON_COMPAT", "0") == "1" or orjson is None
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class ModelSerializer:
+    def __init__(self, model, exclude=(), only=None):
+        self.model = model
+        self.columns = [getattr(model, column.key) for column in model.__table__.columns
+                        if column.key not in exclude and (only is None or column.key in only)]
+        self.keys = tuple(column.key for column in self.columns)
+
+    def only(self, fields):
+        """A serializer for a subset of this one's columns."""
+        return ModelSerializer(self.model, only=[key for key in self.keys if key in fields])
+
+    def select(self):
+        return select(*self.columns)
+
+    def row(self, row):
+        return dict(zip(self.keys, row))
+
+    def rows(self, rows):
+        keys = self.keys
+        return [dict(zip(keys, row)) for row in rows]
+
+    def instance(self, instance):
+        return {key: getattr(instance, key) for key in self.keys}
+
+
+SERIALIZERS = {
+    User: ModelSerializer(User, exclude=("password",)),
+    People: ModelSerializer(People),
+    Planet: ModelSerializer(Planet),
+    Favorite: ModelSerializer(Favorite),
+}
+
+
+@lru_cache(maxsize=256)
+def _sparse_serializer(model, fields):
+    return SERIALIZERS[model].only(fields)
+
+
+def serializer_for(model, fields=None):
+    """
+    The serializer of `model`, or of the sparse fieldset `fields` (the raw
+    comma separated `?fields=` value) so only those columns are selected.
+    """
+    serializer = SERIALIZERS[model]
+    if not fields:
+        return serializer
+
+    requested = frozenset(field.strip() for field in fields.split(",") if field.strip())
+    unknown = requested - set(serializer.keys)
+    if unknown:
+        raise APIException(
+            f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(serializer.keys)}",
+            status_code=400
+        )
+    return _sparse_serializer(model, requested)
+
+
+def _default(value):
+    # same representations as Flask's DefaultJSONProvider
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_ORJSON_OPTIONS = 0
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(obj):
+    """Encode `obj` as compact JSON bytes."""
+    with timer("serialize"):
+        if JSON_COMPAT:
+            return current_app.json.dumps(obj, separators=(",", ":")).encode()
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+
+def negotiate(accept_mimetypes):
+    """The media type, JSON or MessagePack, to encode a payload with for this Accept header."""
+    if msgpack is None:
+        return JSON_MIMETYPE
+    best = accept_mimetypes.best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES)
+    return best if best in MSGPACK_MIMETYPES else JSON_MIMETYPE
+
+
+def encode(obj, mimetype):
+    """`obj` encoded as `mimetype`, for responses built outside Flask (see asgi.py)."""
+    if mimetype in MSGPACK_MIMETYPES:
+        with timer("serialize"):
+            return msgpack.packb(obj, default=_default)
+    return dumps(obj) + b"\n"
+
+
+def wants_msgpack():
+    if msgpack is None or not has_request_context():
+        return False
+    return negotiate(request.accept_mimetypes) in MSGPACK_MIMETYPES
+
+
+def json_response(obj):
+    """Drop-in replacement for jsonify() on the hot read paths."""
+    with timer("serialize"):
+        if wants_msgpack():
+            response = current_app.response_class(msgpack.packb(obj, default=_default), mimetype=MSGPACK_MIMETYPES[0])
+        elif JSON_COMPAT:
+            response = jsonify(obj)
+        else:
+            response = current_app.response_class(
+                orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE),
+                mimetype=JSON_MIMETYPE,
+            )
+    if msgpack is not None:
+        response.vary.add("Accept")
+    return response
@@ -0,0 +1,37 @@
+"""
+NDJSON export mode for the collection endpoints.
+
+Asking for `Accept: application/x-ndjson` (or `?stream=1`) streams the whole
+table, one JSON object per line. Rows are read through a server side cursor
+in batches of STREAM_BATCH_SIZE, so memory stays flat whatever the table size
+and the first batch is sent as soon as it is fetched.
+"""
+import os
+from flask import Response, stream_with_context
+from replicas import read_session
+from serializers import serializer_for, dumps
+from filters import filtered
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 1000))
+
+
+def wants_stream(request):
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(model, args):
+    serializer = serializer_for(model, args.get("fields"))
+    stmt = filtered(model, serializer.select(), args)
+    # yield_per turns on stream_results, i.e. a server side cursor on Postgres
+    stmt = stmt.order_by(model.id).execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    def generate():
+        result = read_session().execute(stmt)
+        for batch in result.partitions():
+            yield b"".join(dumps(row) + b"\n" for row in serializer.rows(batch))
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
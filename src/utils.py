@@ -1,3 +1,5 @@
+import os
+from datetime import datetime, timezone
 from flask import jsonify, url_for
 
 class APIException(Exception):
@@ -15,13 +17,34 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def parse_timestamp(raw):
+    """Parse an ISO 8601 timestamp into the naive UTC datetimes the models store."""
+    value = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+ENABLE_SWAGGER = os.getenv("ENABLE_SWAGGER", "1") == "1"
+
+def swagger_spec(app):
+    """The Swagger spec of `app`, built on first use so flask_swagger is not imported at startup."""
+    if not ENABLE_SWAGGER:
+        raise APIException("Swagger is disabled", status_code=404)
+    if "swagger_spec" not in app.extensions:
+        from flask_swagger import swagger
+        spec = swagger(app)
+        spec["info"] = {"title": "Star Wars API", "version": "1.0"}
+        app.extensions["swagger_spec"] = spec
+    return app.extensions["swagger_spec"]
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    # /admin is served by its own app when it is enabled (see admin.py)
+    links = ['/admin/'] if "admin_dispatcher" in app.extensions else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -0,0 +1,91 @@
+"""
+Per table write counters for the conditional GETs.
+
+Every transaction that writes to a table bumps that table's row in
+table_version once, when it commits. The writes are picked up from the ORM
+flush (`db.session.add()` / `delete()`) and from INSERT/UPDATE/DELETE
+statements run through `db.session.execute()`. Writes that bypass the
+session, like the COPY in ingest.py, call `touch()` themselves, and other
+sessions (the admin app's) are registered with `watch()`.
+
+conditional.py puts the counter into the ETag. Timestamps alone cannot tell
+two writes in the same second apart, and SQLite only stores seconds.
+"""
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, TableVersion
+
+# bookkeeping tables, no endpoint validates against them
+UNVERSIONED = {"table_version", "tombstone", "ingest_checkpoint", "favorite_count"}
+
+
+def touch(*tables):
+    """Bump the versions of `tables` when the current transaction commits."""
+    db.session.info.setdefault("touched_tables", set()).update(tables)
+
+
+def version_column(table):
+    """A scalar subquery with the current version of `table`, 0 before its first write."""
+    return (
+        select(TableVersion.version)
+        .where(TableVersion.resource == table)
+        .scalar_subquery()
+    )
+
+
+def _bump(session, tables):
+    # a fixed order keeps concurrent writers from locking the same rows in opposite orders
+    rows = [dict(resource=table, version=1) for table in sorted(tables)]
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(TableVersion)
+        stmt = stmt.on_conflict_do_update(index_elements=["resource"],
+                                          set_={"version": TableVersion.version + 1})
+        session.execute(stmt, rows)
+        return
+    for row in rows:
+        stmt = (
+            update(TableVersion)
+            .where(TableVersion.resource == row["resource"])
+            .values(version=TableVersion.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if session.execute(stmt).rowcount == 0:
+            session.execute(insert(TableVersion).values(**row))
+
+
+def _record_statement(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        table = state.statement.table.name
+        if table not in UNVERSIONED:
+            state.session.info.setdefault("touched_tables", set()).add(table)
+
+
+def _record_flush(session, flush_context, instances):
+    tables = {instance.__tablename__ for instance in (*session.new, *session.dirty, *session.deleted)}
+    if tables - UNVERSIONED:
+        session.info.setdefault("touched_tables", set()).update(tables - UNVERSIONED)
+
+
+def _bump_on_commit(session):
+    # commit flushes after before_commit, flush now so those writes are recorded too
+    session.flush()
+    tables = session.info.pop("touched_tables", None)
+    if tables:
+        _bump(session, tables)
+
+
+def _forget(session):
+    session.info.pop("touched_tables", None)
+
+
+def watch(session):
+    """Bump the versions of the tables `session` (a scoped_session or sessionmaker) writes to."""
+    event.listen(session, "do_orm_execute", _record_statement)
+    event.listen(session, "before_flush", _record_flush)
+    event.listen(session, "before_commit", _bump_on_commit)
+    event.listen(session, "after_rollback", _forget)
+
+
+def init_app(app):
+    watch(db.session)
@@ -0,0 +1,289 @@
+"""
+Write-behind mode for single favorite adds and removes.
+
+With FAVORITES_WRITE_BEHIND=1, `POST /favorite` and `DELETE /favorite/<id>`
+answer 202 once the change is queued in process instead of committing one
+transaction per click. The queue holds the last operation per
+`(user_id, type, item_id)`, so a burst of add/remove/add on the same
+favorite costs one row write. A background thread flushes it in one
+transaction every WRITE_BEHIND_BATCH_SIZE changes or WRITE_BEHIND_INTERVAL
+seconds, whichever comes first.
+
+- backpressure: with WRITE_BEHIND_MAX_PENDING changes queued, a request
+  waits up to WRITE_BEHIND_WAIT seconds for room and then gets a 503
+- shutdown: the queue is drained at interpreter exit (and from gunicorn's
+  worker_exit hook), so a graceful stop does not lose queued changes
+- read your own writes: `GET /users/<id>/favorites` merges the user's
+  queued changes, and those of the batch being committed, into the committed
+  rows, pending adds have `"pending": true`
+
+Duplicate adds are ignored rather than answered with a 409, and a batch
+that fails (e.g. a user that does not exist) is retried row by row so only
+the offending changes are dropped and logged. A batch that fails because the
+database is unreachable, locked or deadlocked goes back to the front of the
+queue, without overriding newer changes to the same favorites, and is retried
+with exponential backoff up to WRITE_BEHIND_MAX_BACKOFF seconds. drain()
+gives up and drops what is left after WRITE_BEHIND_DRAIN_RETRIES failed
+attempts, so a shutdown does not hang on a dead database. Bulk array POSTs
+and the batch PATCH/DELETE endpoints stay synchronous.
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import delete, tuple_
+from sqlalchemy.exc import OperationalError, InterfaceError
+from utils import APIException
+from models import db, Favorite
+from bulk import insert_ignoring_conflicts
+from sync import record_deletion
+import favorite_counts
+from cache import response_cache
+
+FAVORITES_WRITE_BEHIND = os.getenv("FAVORITES_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", 0.5))
+WRITE_BEHIND_WAIT = float(os.getenv("WRITE_BEHIND_WAIT", 1))
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF", 30))
+WRITE_BEHIND_DRAIN_RETRIES = int(os.getenv("WRITE_BEHIND_DRAIN_RETRIES", 3))
+
+ADD, REMOVE = "add", "remove"
+logger = logging.getLogger("write_behind")
+
+
+def is_transient(error):
+    """Whether `error` is the database being unavailable rather than a change it rejects."""
+    return isinstance(error, (OperationalError, InterfaceError)) or getattr(error, "connection_invalidated", False)
+
+
+class FavoriteWriteQueue:
+    def __init__(self, enabled, max_pending, batch_size, interval, wait):
+        self.enabled = enabled
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.interval = interval
+        self.wait = wait
+        self.app = None
+        self._pending = OrderedDict()
+        # the batch being committed, still visible to pending_for() until its commit
+        self._in_flight = {}
+        # user_id: keys in _pending or _in_flight
+        self._by_user = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self.queued = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.batches = 0
+        self.dropped = 0
+        self.retries = 0
+        self._failures = 0
+
+    #region Producers
+    def _ensure_flusher(self):
+        # started lazily, and again in each worker forked from a preloaded master
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="favorite-write-behind", daemon=True)
+            self._thread.start()
+
+    def _put(self, user_id, type, item_id, operation):
+        key = (user_id, type, item_id)
+        with self._condition:
+            self._ensure_flusher()
+            if key in self._pending:
+                self.coalesced += 1
+            else:
+                if len(self._pending) >= self.max_pending:
+                    self._condition.wait_for(lambda: len(self._pending) < self.max_pending, timeout=self.wait)
+                if len(self._pending) >= self.max_pending:
+                    self.rejected += 1
+                    raise APIException("Too many pending favorite changes, retry shortly", status_code=503)
+                self._by_user.setdefault(user_id, set()).add(key)
+                self.queued += 1
+            self._pending[key] = operation
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    def add(self, user_id, type, item_id):
+        self._put(user_id, type, item_id, ADD)
+
+    def remove(self, user_id, type, item_id):
+        self._put(user_id, type, item_id, REMOVE)
+
+    def pending_for(self, user_id):
+        """`{(type, item_id): operation}` of the user's changes not committed yet."""
+        with self._condition:
+            # a key queued again while in flight has its newer operation in _pending
+            return {key[1:]: self._pending.get(key, self._in_flight.get(key))
+                    for key in self._by_user.get(user_id, ())}
+    #endregion Producers
+
+    #region Flusher
+    def _take(self):
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            key, operation = self._pending.popitem(last=False)
+            self._in_flight[key] = operation
+            batch.append((key, operation))
+        # producers waiting on a full queue can go on
+        self._condition.notify_all()
+        return batch
+
+    def _settle(self, batch, committed):
+        """Take `batch` out of flight, back into the queue when it did not commit."""
+        with self._condition:
+            for key, operation in reversed(batch):
+                del self._in_flight[key]
+                if not committed and key not in self._pending:
+                    self._pending[key] = operation
+                    self._pending.move_to_end(key, last=False)
+                if key not in self._pending:
+                    keys = self._by_user[key[0]]
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_user[key[0]]
+
+    def _apply(self, batch):
+        adds = [dict(user_id=user_id, type=type, item_id=item_id)
+                for (user_id, type, item_id), operation in batch if operation == ADD]
+        removes = [key for key, operation in batch if operation == REMOVE]
+        if adds:
+            # RETURNING only yields the rows actually inserted, duplicates are not counted
+            stmt = insert_ignoring_conflicts(Favorite).returning(Favorite.type, Favorite.item_id)
+            favorite_counts.added(db.session.execute(stmt, adds).all())
+        if removes:
+            stmt = (
+                delete(Favorite)
+                .where(tuple_(Favorite.user_id, Favorite.type, Favorite.item_id).in_(removes))
+                .returning(Favorite.id, Favorite.type, Favorite.item_id)
+                .execution_options(synchronize_session=False)
+            )
+            deleted = db.session.execute(stmt).all()
+            record_deletion(Favorite, [id for id, _, _ in deleted])
+            favorite_counts.removed((type, item_id) for _, type, item_id in deleted)
+
+    def flush(self, batch):
+        """Commit `batch` in one transaction, falling back to one savepoint per change.
+
+        Raises when the database is unavailable, nothing is committed then.
+        """
+        try:
+            self._apply(batch)
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            if is_transient(error):
+                raise
+            for change in batch:
+                try:
+                    with db.session.begin_nested():
+                        self._apply([change])
+                except Exception as error:
+                    if is_transient(error):
+                        db.session.rollback()
+                        raise
+                    self.dropped += 1
+                    logger.exception("Dropped favorite change %s %s", change[1], change[0])
+            db.session.commit()
+        self.flushed += len(batch)
+        self.batches += 1
+        response_cache.invalidate("favorites")
+
+    def _backoff(self, failures):
+        return min(self.interval * 2 ** failures, WRITE_BEHIND_MAX_BACKOFF)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._failures:
+                    # a full queue does not cut the backoff short
+                    self._condition.wait_for(lambda: self._closed, timeout=self._backoff(self._failures))
+                else:
+                    self._condition.wait_for(lambda: self._closed or len(self._pending) >= self.batch_size,
+                                             timeout=self.interval)
+                if self._closed:
+                    return
+                batch = self._take()
+            if batch:
+                self._failures = 0 if self._flush_in_app_context(batch) else self._failures + 1
+
+    def _flush_in_app_context(self, batch):
+        """Flush `batch`, requeueing it if it could not be committed. Returns whether it was."""
+        try:
+            with self.app.app_context():
+                self.flush(batch)
+        except Exception:
+            self._settle(batch, committed=False)
+            self.retries += 1
+            logger.exception("Could not flush %d favorite changes, requeued them", len(batch))
+            return False
+        self._settle(batch, committed=True)
+        return True
+
+    def drain(self):
+        """Stop the flusher and commit everything still queued, from the calling thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join()
+        failures = 0
+        while True:
+            with self._condition:
+                batch = self._take()
+            if not batch:
+                return
+            if self._flush_in_app_context(batch):
+                failures = 0
+                continue
+            failures += 1
+            if failures > WRITE_BEHIND_DRAIN_RETRIES:
+                with self._condition:
+                    lost = len(self._pending)
+                    self._pending.clear()
+                    self._by_user.clear()
+                    self.dropped += lost
+                logger.error("Gave up on %d favorite changes after %d failed flushes", lost, failures)
+                return
+            time.sleep(self._backoff(failures))
+    #endregion Flusher
+
+    def stats(self):
+        with self._condition:
+            return {
+                "enabled": self.enabled,
+                "pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "max_pending": self.max_pending,
+                "queued": self.queued,
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "retries": self.retries,
+            }
+
+
+favorite_writes = FavoriteWriteQueue(
+    FAVORITES_WRITE_BEHIND,
+    max_pending=WRITE_BEHIND_MAX_PENDING,
+    batch_size=WRITE_BEHIND_BATCH_SIZE,
+    interval=WRITE_BEHIND_INTERVAL,
+    wait=WRITE_BEHIND_WAIT,
+)
+
+
+def init_app(app):
+    if not favorite_writes.enabled:
+        return
+    favorite_writes.app = app
+    atexit.register(favorite_writes.drain)